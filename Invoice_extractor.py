@@ -1,13 +1,32 @@
 import os
+import asyncio
 import base64
 import json
 import fitz  # PyMuPDF
 import io
 import logging
 import random
+import re
+import time
+import weakref
+from contextlib import aclosing
 from dotenv import load_dotenv
 from groq import Groq
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from extraction_cache import page_cache, document_cache, make_cache_key, make_fingerprint
+from pipeline_trace import trace_stage, record_stage, record_llm_call
+from metrics import track_provider_call, observe_llm_usage, observe_document
+from llm_cassette import llm_cassette
+from llm_resilience import call_with_retries, acall_with_retries
+from po_mapping import map_sap_po
+from retention_parsing import parse_retention_case
+from page_selection import (
+    DOCUMENT_TYPE_KEYWORDS, PAGE_SELECTION_PRIORITY, page_keyword_hits, predicted_document_type,
+    rank_pages, required_documents_extracted, select_pages_for_workflow,
+)
+from rate_limiter import rate_limiter, estimate_request_tokens
+from prompt_projection import projected_prompt_data
+from pdf_renderer import render_pdf_pages, iter_rendered_pages, render_single_page, render_thumbnails, find_duplicate
                                                               
 # -------------------------
 # Setup logging
@@ -27,10 +46,29 @@ if not GROQ_API_KEY:
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY not found in .env file!")
 
-groq_client = Groq(api_key=GROQ_API_KEY)
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# SDK retries are off: llm_resilience retries with backoff, deadlines and hedging instead
+groq_client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
+# Async clients are created lazily, one per event loop (see get_async_openai_client)
+_async_openai_clients = weakref.WeakKeyDictionary()
+
+# Page budget per PDF. Longer PDFs are ranked by their text layer and the
+# MAX_PAGES most relevant pages are processed (see select_pages_to_process).
 MAX_PAGES = int(os.getenv("MAX_PAGES", 8))
+# Maximum number of page extraction calls in flight at once for a single PDF
+MAX_CONCURRENT_PAGES = int(os.getenv("MAX_CONCURRENT_PAGES", 4))
+# "vision": every page goes to GPT-4o Vision.
+# "auto": pages with a usable native text layer go to a cheaper text-only call instead.
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "vision")
+TEXT_EXTRACTION_MODEL = os.getenv("TEXT_EXTRACTION_MODEL", "gpt-4o-mini")
+# "on": classify every page from a low-detail thumbnail first, then run full extraction
+# only on pages whose document type the workflow uses (see triage_pages_async)
+PAGE_TRIAGE = os.getenv("PAGE_TRIAGE", "off")
+TRIAGE_MODEL = os.getenv("TRIAGE_MODEL", "gpt-4o-mini")
+# "on": extract pages most likely to hold the required documents first, and cancel the
+# remaining page calls once they are extracted (see required_documents_extracted)
+EARLY_EXIT = os.getenv("EARLY_EXIT", "off")
 
 # -------------------------
 # Helpers
@@ -38,12 +76,9 @@ MAX_PAGES = int(os.getenv("MAX_PAGES", 8))
 def encode_image(image_bytes):
     return base64.b64encode(image_bytes).decode("utf-8")
 
-def extract_invoice_data(image_bytes):
-    """
-    Extract data from a single page image using OpenAI GPT-4o Vision API.
-    Generic extraction that supports multiple document types for different SAP workflows.
-    """
-    prompt = """You are an expert invoice OCR and document understanding AI.
+PAGE_EXTRACTION_MODEL = "gpt-4o"
+
+PAGE_EXTRACTION_PROMPT = """You are an expert invoice OCR and document understanding AI.
 Extract all visible information from this image and categorize it by document type.
 The document may contain Arabic, English, or both.
 
@@ -88,76 +123,432 @@ RULES:
 
 Return the JSON object only."""
 
+# Same instructions and output schema, for pages read from the PDF text layer
+PAGE_TEXT_EXTRACTION_PROMPT = PAGE_EXTRACTION_PROMPT.replace(
+    "Extract all visible information from this image",
+    "Extract all information from the page text provided"
+) + """
+
+The page text was read from the PDF text layer. Each line starts with the [x,y]
+position of its first word (points from the top-left corner of the page).
+Use the positions to rebuild table rows and columns."""
+
+# Bump when the extraction output contract changes without the prompt text changing
+PAGE_EXTRACTION_PROMPT_VERSION = "2"
+
+# Structured output for the page envelope. "data" holds whatever fields the page has,
+# which strict mode cannot express (it requires every object's properties to be listed),
+# so the schema is non-strict: the reply is still valid JSON in this shape, and
+# _parse_page_extraction checks the envelope.
+PAGE_EXTRACTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "page_extraction",
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "document_type": {"type": "string"},
+                "data": {"type": "object"},
+            },
+            "required": ["document_type", "data"],
+        },
+    },
+}
+
+
+def get_async_openai_client():
+    """
+    Return an AsyncOpenAI client bound to the running event loop.
+    httpx connection pools cannot be shared across loops, so each loop gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        _async_openai_clients[loop] = client
+    return client
+
+
+def _run_sync(coro):
+    """Run an async pipeline from sync code, closing the loop's OpenAI client afterwards."""
+    async def runner():
+        try:
+            return await coro
+        finally:
+            client = _async_openai_clients.pop(asyncio.get_running_loop(), None)
+            if client is not None:
+                await client.close()
+
+    return asyncio.run(runner())
+
+
+def _llm_provider(client):
+    return "groq" if isinstance(client, Groq) else "openai"
+
+
+def _chat_completion(client, stage, **kwargs):
+    """
+    Single entry point for sync LLM calls (OpenAI and Groq clients).
+    Records wall time and token usage of the call under `stage` in the active pipeline trace,
+    and in the per-provider latency and token metrics.
+    With LLM_CASSETTE_MODE=record/replay, calls are written to / served from the LLM cassette.
+    Transient failures are retried with backoff within a per-call deadline (llm_resilience);
+    every attempt is recorded separately. Each attempt first queues for the per-model
+    request/token budget shared by all worker processes (rate_limiter).
+    """
+    provider, model = _llm_provider(client), kwargs.get("model")
+    if llm_cassette.replaying:
+        started = time.perf_counter()
+        response = llm_cassette.replay(provider, kwargs)
+        record_llm_call(stage, model, (time.perf_counter() - started) * 1000, response=response)
+        return response
+
+    estimated_tokens = estimate_request_tokens(kwargs)
+
+    def attempt(timeout):
+        rate_limiter.acquire(model, estimated_tokens)
+        started = time.perf_counter()
+        try:
+            with track_provider_call(provider, model):
+                response = client.chat.completions.create(**kwargs, timeout=timeout)
+        except Exception as e:
+            record_llm_call(stage, model, (time.perf_counter() - started) * 1000, error=e)
+            raise
+        record_llm_call(stage, model, (time.perf_counter() - started) * 1000, response=response)
+        observe_llm_usage(provider, model, response)
+        rate_limiter.reconcile(model, estimated_tokens, getattr(response.usage, "total_tokens", 0))
+        return response
+
+    response = call_with_retries(attempt, provider, model, stage)
+    if llm_cassette.recording:
+        llm_cassette.record(provider, stage, kwargs, response)
+    return response
+
+
+async def _achat_completion(client, stage, **kwargs):
+    """
+    Async counterpart of _chat_completion for the AsyncOpenAI client. Slow attempts
+    can also be hedged with a duplicate request (LLM_HEDGE_PERCENTILE).
+    """
+    provider, model = _llm_provider(client), kwargs.get("model")
+    if llm_cassette.replaying:
+        started = time.perf_counter()
+        response = llm_cassette.replay(provider, kwargs)
+        record_llm_call(stage, model, (time.perf_counter() - started) * 1000, response=response)
+        return response
+
+    estimated_tokens = estimate_request_tokens(kwargs)
+
+    async def attempt(timeout):
+        await rate_limiter.acquire_async(model, estimated_tokens)
+        started = time.perf_counter()
+        try:
+            with track_provider_call(provider, model):
+                response = await client.chat.completions.create(**kwargs, timeout=timeout)
+        except BaseException as e:
+            # Includes cancellation of the losing request of a hedged pair
+            record_llm_call(stage, model, (time.perf_counter() - started) * 1000, error=e)
+            raise
+        record_llm_call(stage, model, (time.perf_counter() - started) * 1000, response=response)
+        observe_llm_usage(provider, model, response)
+        await asyncio.to_thread(
+            rate_limiter.reconcile, model, estimated_tokens, getattr(response.usage, "total_tokens", 0)
+        )
+        return response
+
+    response = await acall_with_retries(attempt, provider, model, stage)
+    if llm_cassette.recording:
+        # Page requests carry base64 images; keep the file write off the event loop
+        await asyncio.to_thread(llm_cassette.record, provider, stage, kwargs, response)
+    return response
+
+
+def _page_extraction_request(image_bytes):
+    """
+    Build the chat completion arguments for a single page vision extraction.
+    The prompt text precedes the image so every request shares the same cacheable prefix.
+    """
+    # Convert image to base64 for API transmission
+    base64_image = encode_image(image_bytes)
+
+    return {
+        "model": PAGE_EXTRACTION_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": PAGE_EXTRACTION_PROMPT
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}"
+                        }
+                    }
+                ]
+            }
+        ],
+        "max_tokens": 4096,
+        "temperature": 0.1,
+        "response_format": PAGE_EXTRACTION_RESPONSE_FORMAT,
+    }
+
+
+def _page_cache_key(image_bytes):
+    """Cache key for a page: rendered image bytes + fingerprint of the exact extraction request."""
+    fingerprint = make_fingerprint(
+        PAGE_EXTRACTION_PROMPT_VERSION, PAGE_EXTRACTION_MODEL, PAGE_EXTRACTION_PROMPT
+    )
+    return make_cache_key(image_bytes, fingerprint)
+
+
+def _page_text_cache_key(page_text):
+    """Cache key for a text-routed page: page text + fingerprint of the text extraction request."""
+    fingerprint = make_fingerprint(
+        PAGE_EXTRACTION_PROMPT_VERSION, TEXT_EXTRACTION_MODEL, PAGE_TEXT_EXTRACTION_PROMPT
+    )
+    return make_cache_key(page_text.encode("utf-8"), fingerprint)
+
+
+def _parse_page_extraction(response):
+    """
+    Parse a page extraction reply into {"document_type": ..., "data": {...}}.
+    Raises ValueError for truncated replies and replies without the envelope.
+    """
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        raise ValueError("page extraction reply was truncated (max_tokens reached)")
+    page = json.loads(choice.message.content)
+    if not isinstance(page, dict) or not isinstance(page.get("document_type"), str) or not isinstance(page.get("data"), dict):
+        raise ValueError("page extraction reply does not match the document_type/data envelope")
+    return page
+
+
+def _cache_page(cache_key, page):
+    page_cache.set(cache_key, json.dumps(page, ensure_ascii=False, separators=(",", ":")))
+
+
+def _cached_page(cache_key):
+    cached = page_cache.get(cache_key)
+    return json.loads(cached) if cached is not None else None
+
+
+def extract_invoice_data(image_bytes):
+    """
+    Extract data from a single page image using OpenAI GPT-4o Vision API.
+    Generic extraction that supports multiple document types for different SAP workflows.
+    Results are cached by page content, so resubmitted pages skip the API call.
+    Returns the parsed page: {"document_type": ..., "data": {...}}.
+    """
+    cache_key = _page_cache_key(image_bytes)
+    cached = _cached_page(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        # Convert image to base64 for API transmission
-        base64_image = encode_image(image_bytes)
-        
         # Call the OpenAI Vision API
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
+        response = _chat_completion(openai_client, "extract_page", **_page_extraction_request(image_bytes))
+        page = _parse_page_extraction(response)
+        _cache_page(cache_key, page)
+        return page
+
+    except Exception as e:
+        logger.error(f"OpenAI API extraction failed: {e}")
+        raise
+
+
+async def extract_invoice_data_async(image_bytes):
+    """
+    Async variant of extract_invoice_data using the AsyncOpenAI client.
+    Lets several pages of the same PDF be in flight at once. Shares the page cache.
+    """
+    cache_key = _page_cache_key(image_bytes)
+    cached = _cached_page(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await _achat_completion(
+            get_async_openai_client(), "extract_page", **_page_extraction_request(image_bytes)
+        )
+        page = _parse_page_extraction(response)
+        _cache_page(cache_key, page)
+        return page
+
+    except Exception as e:
+        logger.error(f"OpenAI API extraction failed: {e}")
+        raise
+
+async def extract_invoice_text_data_async(page_text):
+    """
+    Extract data from a page's native text layer with a text-only model call.
+    Same output schema as extract_invoice_data, at a fraction of the vision cost.
+    """
+    cache_key = _page_text_cache_key(page_text)
+    cached = _cached_page(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = await _achat_completion(
+            get_async_openai_client(),
+            "extract_page_text",
+            model=TEXT_EXTRACTION_MODEL,
             messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
+                {"role": "system", "content": PAGE_TEXT_EXTRACTION_PROMPT},
+                {"role": "user", "content": f"PAGE TEXT:\n{page_text}"},
             ],
             max_tokens=4096,
-            temperature=0.1
+            temperature=0.1,
+            response_format=PAGE_EXTRACTION_RESPONSE_FORMAT,
         )
-        
-        response_text = response.choices[0].message.content
-         
-        # Clean response and extract JSON
-        response_clean = response_text.strip()
-        if response_clean.startswith("```json"):
-            response_clean = response_clean[7:]
-        elif response_clean.startswith("```"):
-            response_clean = response_clean[3:]
-        if response_clean.endswith("```"):
-            response_clean = response_clean[:-3]
-        response_clean = response_clean.strip()
-        
-        # Validate JSON
-        json.loads(response_clean)
-        return response_clean
-        
+        page = _parse_page_extraction(response)
+        _cache_page(cache_key, page)
+        return page
+
     except Exception as e:
-        logger.error(f"OpenAI API extraction failed: {e}")
+        logger.error(f"OpenAI text extraction failed: {e}")
         raise
 
-def pdf_to_images(pdf_bytes):
-    """Convert PDF bytes to image bytes (up to MAX_PAGES)."""
+
+TRIAGE_DOCUMENT_TYPES = [
+    "tax_invoice", "purchase_order", "gl_document", "interim_payment_certificate",
+    "invoice_submittal_payment_request", "other",
+]
+
+PAGE_TRIAGE_PROMPT = """You are classifying the pages of a scanned invoice pack (Arabic and/or English).
+Each page image below is preceded by its page number. Label every page with one document type:
+
+- tax_invoice: Tax Invoice / فاتورة ضريبية, including its continuation and payment summary pages
+- purchase_order: Purchase Order / أمر الشراء
+- gl_document: GL / accounting document / مستند محاسبي
+- interim_payment_certificate: Interim Payment Certificate (IPC) / شهادة الدفع المؤقتة
+- invoice_submittal_payment_request: Invoice Submittal Payment Request Form / طلب دفع
+- other: cover sheets, stamps, blank pages, annexes, drawings and anything else
+
+Return one entry per page."""
+
+PAGE_TRIAGE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "page_triage",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "pages": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "page": {"type": "integer"},
+                            "document_type": {"type": "string", "enum": TRIAGE_DOCUMENT_TYPES},
+                        },
+                        "required": ["page", "document_type"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["pages"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def triage_pages_async(pdf_bytes, page_count, page_indices=None):
+    """
+    Cheap document-type classification of every page (or of page_indices), in one
+    gpt-4o-mini call over grayscale thumbnails sent at detail "low" (a fixed ~85 image
+    tokens per page).
+
+    Returns: list with one document type per page of page_count (None where the page
+    was not labelled), or None when triage failed.
+    """
+    page_indices = list(range(page_count) if page_indices is None else page_indices)
+    thumbnails = await asyncio.to_thread(render_thumbnails, pdf_bytes, page_count, page_indices)
+    content = [{"type": "text", "text": PAGE_TRIAGE_PROMPT}]
+    for i, thumbnail in zip(page_indices, thumbnails):
+        if thumbnail is None:
+            continue
+        content.append({"type": "text", "text": f"Page {i + 1}:"})
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{encode_image(thumbnail)}", "detail": "low"},
+        })
+
+    try:
+        response = await _achat_completion(
+            get_async_openai_client(),
+            "triage_pages",
+            model=TRIAGE_MODEL,
+            messages=[{"role": "user", "content": content}],
+            max_tokens=50 + 25 * len(page_indices),
+            temperature=0,
+            response_format=PAGE_TRIAGE_RESPONSE_FORMAT,
+        )
+        labels = json.loads(response.choices[0].message.content)["pages"]
+    except Exception as e:
+        logger.warning(f"Page triage failed, extracting every page: {e}")
+        return None
+
+    page_types = [None] * page_count
+    for label in labels:
+        if 1 <= label["page"] <= page_count:
+            page_types[label["page"] - 1] = label["document_type"]
+    return page_types
+
+
+def select_pages_to_process(pdf_bytes, rank=False):
+    """
+    Open the PDF and choose the pages to process within the MAX_PAGES budget.
+
+    PDFs up to MAX_PAGES pages are processed whole. Longer ones are ranked from their
+    native text layer (rank_pages) so a purchase order or invoice summary past the
+    first MAX_PAGES pages is not lost. Fully scanned PDFs cannot be ranked and keep
+    their first MAX_PAGES pages. With rank, the text layer is read for short PDFs too.
+
+    Returns: (page count of the PDF, sorted indices of the selected pages,
+              page_keyword_hits() per page or None when the text layer was not read)
+    """
     try:
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     except Exception as e:
         logger.error(f"Failed to open PDF: {e}")
         raise
 
-    page_count = min(len(doc), MAX_PAGES)
-    pages_images = []
+    try:
+        page_count = len(doc)
+        if page_count <= MAX_PAGES and not rank:
+            return page_count, list(range(page_count)), None
+        page_hits = []
+        for i in range(page_count):
+            try:
+                page_hits.append(page_keyword_hits(doc.load_page(i).get_text()))
+            except Exception as e:
+                logger.warning(f"Failed to read text layer of page {i+1}: {e}")
+                page_hits.append(None)
+    finally:
+        doc.close()
+
+    selected = sorted(rank_pages(page_hits)[:MAX_PAGES])
+    if page_count > MAX_PAGES:
+        logger.info(f"Selected pages {[i + 1 for i in selected]} of {page_count} (MAX_PAGES={MAX_PAGES})")
+    return page_count, selected, page_hits
 
-    for page_index in range(page_count):
-        try:
-            page = doc.load_page(page_index)
-            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-            img_data = pix.tobytes("jpg")
-            pages_images.append(img_data)
-        except Exception as e:
-            logger.error(f"Failed to process page {page_index+1}: {e}")
 
-    doc.close()
-    return pages_images
+def pdf_to_images(pdf_bytes):
+    """
+    Convert PDF bytes to image bytes for the pages chosen by select_pages_to_process.
+    Pages are rasterized in parallel on the render process pool (see pdf_renderer).
+    """
+    page_count, selected, _ = select_pages_to_process(pdf_bytes)
+
+    # Pages that failed to render come back as None and are skipped
+    return [img for img in render_pdf_pages(pdf_bytes, page_count, page_indices=selected) if img is not None]
 
 
 def pdf_to_base64_images(pdf_bytes):
@@ -170,27 +561,18 @@ def pdf_to_base64_images(pdf_bytes):
     return pages_base64, pages_images
 
 
-def transform_to_sap_po_json(extracted_data: dict) -> dict:
-    """
-    SAP PURCHASE ORDER WORKFLOW TRANSFORMATION
-    
-    Process extracted JSON through Groq LLM to generate the final structured output
-    for SAP Purchase Order posting (MIRO API).
-    
-    This is specific to SAP PO workflow. For other workflows (e.g., SAP Retention),
-    create a separate transformation function.
-    
-    Uses llama-3.3-70b-versatile model for fast processing.
-    """
-    import random
-    
-    prompt = f"""You are a data transformation expert. Analyze the following extracted invoice/purchase order data and transform it into the exact JSON structure required.
+# -------------------------
+# Transform prompts
+# -------------------------
+# Static instructions go first (system message), byte-identical on every call, so
+# provider prompt caching can reuse them; per-invoice data follows in the user message.
+# Bump TRANSFORM_PROMPT_VERSION whenever either prompt changes.
+TRANSFORM_PROMPT_VERSION = "2"
 
-EXTRACTED DATA:
-{json.dumps(extracted_data, indent=2, ensure_ascii=False)}
+SAP_PO_TRANSFORM_PROMPT = """You are a data transformation expert. Analyze the extracted invoice/purchase order data (given after these instructions) and transform it into the exact JSON structure required.
 
 REQUIRED OUTPUT FORMAT:
-{{
+{
   "docDate": "YYYYMMDD",  // Document date in YYYYMMDD format
   "postingDate": "YYYYMMDD",  // Posting date in YYYYMMDD format (use today if not found)
   "refDocno": "",  // Invoice Number
@@ -198,7 +580,7 @@ REQUIRED OUTPUT FORMAT:
   "currency": "SAR",  // Always fixed as "SAR"
   "grossAmount": "",  // Total amount from tax invoice (with VAT)
   "item": [
-    {{
+    {
       "invoiceDocItem": "000001",  // Incremental: 000001, 000002, etc.
       "poNumber": "",  // Purchase Order number inside "purchase_order" key
       "poItem": "00010",  // Based on serial number: 1->00010, 2->00020, etc.
@@ -206,9 +588,9 @@ REQUIRED OUTPUT FORMAT:
       "unit": "",  // unit of that line item from tax invoice 
       "itemAmount": "",  // Total amount for that item before VAT from tax invoice
       "sheetNo": ""  // Will be auto-generated
-    }}
+    }
   ]
-}}
+}
 
 RULES:
 1. Convert any date format to YYYYMMDD (e.g., "25/11/2025" -> "20251125")
@@ -228,141 +610,26 @@ RULES:
 
 Return the transformed JSON object only."""
 
-    try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            # model="openai/gpt-oss-120b",
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }],
-            temperature=0.1,
-            response_format={"type": "json_object"},
-        )
-        
-        result = json.loads(completion.choices[0].message.content)
-        
-        # Generate random sheetNo for each item
-        if "item" in result and isinstance(result["item"], list):
-            for item in result["item"]:
-                if not item.get("sheetNo") or item.get("sheetNo") == "":
-                    item["sheetNo"] = str(random.randint(1000000000, 9999999999))
-                if item["poNumber"] == ("020007108"):
-                    item["poNumber"] = "3020007108"
-                # if item["poNumber"] == ("020007108" or "3020007108"):
-                #     item["poNumber"] = "3160000028"
-                # if item["poNumber"] == ("3030003358"):
-                #     item["poNumber"] = "3160000027"
-                # if item["poNumber"] == ("3030003277"):
-                #     item["poNumber"] = "3160000026"
-                
-        
-        # Ensure fixed values are correct
-        result["companyCode"] = "2000"
-        result["currency"] = "SAR"
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Groq transformation failed: {e}")
-        raise
-
-def detect_retention_case(extracted_data: dict) -> str:
-    """
-    Openai Layer:
-    Detect whether the invoice is:
-    - simple_retention
-    - advance_retention
-
-    Uses ONLY tax_invoice data (especially the payment summary table).
-    """
-
-    # Extract only tax invoice portion
-    tax_invoice_data = extracted_data.get("tax_invoice", {})
-    print(tax_invoice_data)
-
-    prompt = f"""
-Determine the retention case type from the TAX INVOICE data only.
 
-Cases:
-1. simple_retention → No advance payment OR advance payment = 0
-2. advance_retention → Advance payment OR Recovery of Advance Payment > 0
-
-Look ONLY inside the tax invoice payment summary table.
-
-Return ONLY one value:
-simple_retention
-or
-advance_retention
-
-TAX INVOICE DATA:
-{json.dumps(tax_invoice_data, indent=2, ensure_ascii=False)}
-"""
-
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-
-    case = completion.choices[0].message.content.strip().lower()
-
-    if "advance" in case:
-        return "advance_retention"
-
-    return "simple_retention"
-
-
-def transform_to_sap_retention_json(extracted_data: dict) -> dict:
-    """
-    SAP RETENTION WORKFLOW TRANSFORMATION (F-43 API)
-    
-    Process extracted JSON through Groq LLM to generate the final structured output
-    for SAP Retention posting (F-43 API).
-    
-    This is specific to SAP Retention workflow for invoices WITHOUT Purchase Orders.
-    Extracts data from:
-    - Tax Invoice (last page - contains amounts)
-    - Invoice Submittal Payment Request Form (contains vendor info)
-    - Interim Payment Certificate (if present)
-    
-    Uses llama-3.3-70b-versatile model for fast processing.
-    """
-    import datetime
-
-    case_type = detect_retention_case(extracted_data)
-    case_hint = f"\nRETENTION CASE TYPE DETECTED: {case_type}\n"
-    print(case_type)
-
-    allowed_data = {
-    "tax_invoice": extracted_data.get("tax_invoice", {}),
-    "supplier_code from invoice_submittal_payment_request": extracted_data.get("invoice_submittal_payment_request", {}).get("Supplier Code (SAP)", ""),
-    "contract_number from interim payment certificate": extracted_data.get("interim_payment_certificate", {}).get("Contract Number", "")
-}
-    print(allowed_data)
-    
-    prompt = case_hint + f"""You are a data transformation expert specializing in SAP Retention invoices. Analyze the following extracted invoice data and transform it into the exact JSON structure required for SAP F-43 API.
+SAP_RETENTION_TRANSFORM_PROMPT = """You are a data transformation expert specializing in SAP Retention invoices. Analyze the extracted invoice data (given after these instructions) and transform it into the exact JSON structure required for SAP F-43 API.
 
 There are two types of Retention cases:
 1. Simple Retention: No advance payment. 4 line items will be generated in this case
 2. Advance Retention: Contains an advance payment not equal to zero(Recovery of Advance Payment not equal to zero). 5 line items will be generated in this case
 
-EXTRACTED DATA:
-{json.dumps(allowed_data, indent=2, ensure_ascii=False)}
-
 REQUIRED OUTPUT FORMAT:
-{{
+{
   "DOC_NO": "1",
   "REF_DOC_NO": "",
   "COMPANY_CODE": "2000",
-  "FISCAL_YEAR": "{datetime.datetime.now().year}",
-  "FISCAL_PERIOD": "{datetime.datetime.now().strftime('%m')}",
+  "FISCAL_YEAR": "YYYY",
+  "FISCAL_PERIOD": "MM",
   "DOCUMENT_DATE": "DD.MM.YYYY",
   "DOC_TYPE": "KR",
   "HDRTOITEMNAV": [
     // Array of line items (4 or 5 depending on case)
   ]
-}}
+}
 
 
 TRANSFORMATION RULES:
@@ -371,14 +638,14 @@ HEADER FIELDS:
 1. DOC_NO: Always "1" (fixed)
 2. REF_DOC_NO: Extract invoice number from tax_invoice (look for: Invoice No, رقم الفاتورة, Invoice Number, Ref)
 3. COMPANY_CODE: Always "2000" (fixed)
-4. FISCAL_YEAR: Current year ({datetime.datetime.now().year})
-5. FISCAL_PERIOD: Current month as 2-digit string ({datetime.datetime.now().strftime('%m')} - January="01", February="02", etc.)
+4. FISCAL_YEAR: Current year (CURRENT FISCAL YEAR below)
+5. FISCAL_PERIOD: Current month as 2-digit string (CURRENT FISCAL PERIOD below - January="01", February="02", etc.)
 6. DOCUMENT_DATE: Extract date from tax_invoice and convert to DD.MM.YYYY format (e.g., "23.12.2024")
 7. DOC_TYPE: Always "KR" (fixed)
 
 LINE ITEMS LOGIC:
 Extract amounts from the LAST PAGE of tax_invoice from the payment summary table.
-If advance retention case then 5 line items otherwise 4 line items if simple retention case(Use Detected case as defined).
+If advance retention case then 5 line items otherwise 4 line items if simple retention case(Use the RETENTION CASE TYPE given with the data).
 
 LINE 1 - Vendor/Net Payable Line:
 - DOC_NO: "1"
@@ -464,20 +731,132 @@ IMPORTANT NOTES:
 
 Return the transformed JSON object only."""
 
+
+def transform_to_sap_po_json(extracted_data: dict) -> dict:
+    """
+    SAP PURCHASE ORDER WORKFLOW TRANSFORMATION
+    
+    Process extracted JSON through Groq LLM to generate the final structured output
+    for SAP Purchase Order posting (MIRO API).
+    
+    This is specific to SAP PO workflow. For other workflows (e.g., SAP Retention),
+    create a separate transformation function.
+    
+    Clearly labelled invoices are mapped by the rule-based engine in po_mapping;
+    llama-3.3-70b-versatile is only called when a required field cannot be resolved.
+    """
+    import random
+
+    with trace_stage("map_sap_po"):
+        result = map_sap_po(extracted_data)
+    if result is None:
+        result = _llm_transform_sap_po(extracted_data)
+    else:
+        logger.info("SAP PO payload mapped by rules (no LLM call)")
+
+    # Generate random sheetNo for each item
+    if "item" in result and isinstance(result["item"], list):
+        for item in result["item"]:
+            if not item.get("sheetNo") or item.get("sheetNo") == "":
+                item["sheetNo"] = str(random.randint(1000000000, 9999999999))
+            if item["poNumber"] == ("020007108"):
+                item["poNumber"] = "3020007108"
+            # if item["poNumber"] == ("020007108" or "3020007108"):
+            #     item["poNumber"] = "3160000028"
+            # if item["poNumber"] == ("3030003358"):
+            #     item["poNumber"] = "3160000027"
+            # if item["poNumber"] == ("3030003277"):
+            #     item["poNumber"] = "3160000026"
+
+    # Ensure fixed values are correct
+    result["companyCode"] = "2000"
+    result["currency"] = "SAR"
+
+    return result
+
+
+def _llm_transform_sap_po(extracted_data: dict) -> dict:
+    """Groq LLM fallback for transform_to_sap_po_json."""
+    payload = projected_prompt_data(extracted_data, "sap_po", "transform_sap_po")
+
+    try:
+        completion = _chat_completion(
+            groq_client,
+            "transform_sap_po",
+            model="llama-3.3-70b-versatile",
+            # model="openai/gpt-oss-120b",
+            messages=[
+                {"role": "system", "content": SAP_PO_TRANSFORM_PROMPT},
+                {"role": "user", "content": f"EXTRACTED DATA:\n{payload}"},
+            ],
+            temperature=0.1,
+            response_format={"type": "json_object"},
+        )
+        
+        return json.loads(completion.choices[0].message.content)
+        
+    except Exception as e:
+        logger.error(f"Groq transformation failed: {e}")
+        raise
+
+
+def transform_to_sap_retention_json(extracted_data: dict) -> dict:
+    """
+    SAP RETENTION WORKFLOW TRANSFORMATION (F-43 API)
+    
+    Process extracted JSON through Groq LLM to generate the final structured output
+    for SAP Retention posting (F-43 API).
+    
+    This is specific to SAP Retention workflow for invoices WITHOUT Purchase Orders.
+    Extracts data from:
+    - Tax Invoice (last page - contains amounts)
+    - Invoice Submittal Payment Request Form (contains vendor info)
+    - Interim Payment Certificate (if present)
+    
+    Uses llama-3.3-70b-versatile model for fast processing.
+    """
+    import datetime
+
+    # The case is read from the payment summary fields; when they are ambiguous the
+    # model decides it in this same call and reports it as RETENTION_CASE.
+    case_type = parse_retention_case(extracted_data.get("tax_invoice", {}))
+    if case_type is not None:
+        case_hint = f"RETENTION CASE TYPE DETECTED: {case_type}"
+    else:
+        case_hint = (
+            "RETENTION CASE TYPE: not pre-detected. Decide it from the tax invoice payment summary table: "
+            "advance_retention if there is an Advance Payment or Recovery of Advance Payment > 0, otherwise "
+            "simple_retention. Add the decision to the output as \"RETENTION_CASE\": \"simple_retention\" "
+            "or \"advance_retention\"."
+        )
+    logger.info(f"Retention case: {case_type or 'decided by transform model'}")
+
+    allowed_data = projected_prompt_data(extracted_data, "sap_retention", "transform_sap_retention")
+
+    prompt = (
+        f"CURRENT FISCAL YEAR: {datetime.datetime.now().year}\n"
+        f"CURRENT FISCAL PERIOD: {datetime.datetime.now().strftime('%m')}\n"
+        f"{case_hint}\n\n"
+        f"EXTRACTED DATA:\n{allowed_data}"
+    )
+
     try:
-        completion = openai_client.chat.completions.create(
+        completion = _chat_completion(
+            openai_client,
+            "transform_sap_retention",
             model="gpt-4o-mini",
             messages=[
-                {
-                "role": "user",
-                "content": prompt
-            }
+                {"role": "system", "content": SAP_RETENTION_TRANSFORM_PROMPT},
+                {"role": "user", "content": prompt},
             ],
             temperature=0.1,
             response_format={"type": "json_object"},
         )
         
         result = json.loads(completion.choices[0].message.content)
+        model_case = result.pop("RETENTION_CASE", None)
+        if case_type is None:
+            logger.info(f"Retention case decided by transform model: {model_case}")
         
         # Ensure fixed values are correct
         result["DOC_NO"] = "1"
@@ -560,51 +939,41 @@ Return the transformed JSON object only."""
         raise
 
 
-def extract_all_pages(pdf_bytes):
+def group_extracted_pages(page_results: list) -> dict:
     """
-    Generic PDF extraction that supports multiple document types.
-    Dynamically categorizes pages by document type and merges multi-page documents.
+    Categorize per-page extraction results by document type and merge multi-page documents.
     
-    Supports:
-    - tax_invoice (Tax Invoice / فاتورة ضريبية)
-    - purchase_order (Purchase Order / أمر الشراء)
-    - gl_document (GL Document / مستند محاسبي)
-    - interim_payment_certificate (IPC / شهادة الدفع المؤقتة)
-    - invoice_submittal_payment_request (Invoice Submittal Payment Request Form)
+    Args:
+        page_results: Parsed page extractions in page order. Entries are None for
+                      pages that failed to extract; those pages are skipped.
     
     Returns: Dictionary with:
         - document types as keys with extracted data as values
         - "workflow_type" key indicating which SAP workflow to use
     """
-    pages_images = pdf_to_images(pdf_bytes)
-    
     # Dynamic tracking of document pages (supports any document type)
     doc_pages = {}
     
-    # Extract each page and categorize by document type
-    for i, img_bytes in enumerate(pages_images):
-        try:
-            raw_json = extract_invoice_data(img_bytes)
-            page_data = json.loads(raw_json)
-            
-            # Get document type from extraction
-            doc_type = page_data.get("document_type", "").lower().strip()
-            data = page_data.get("data", page_data)
-            
-            # Normalize document type names
-            doc_type_normalized = normalize_document_type(doc_type, data)
-            
-            # Initialize list for this document type if first occurrence
-            if doc_type_normalized not in doc_pages:
-                doc_pages[doc_type_normalized] = []
-            
-            # Add page data to the appropriate document type
-            doc_pages[doc_type_normalized].append(data)
-            
-            logger.info(f"Page {i+1}: Identified as '{doc_type_normalized}'")
-            
-        except Exception as e:
-            logger.error(f"Failed to extract page {i+1}: {e}")
+    # Categorize each page by document type
+    for i, page_data in enumerate(page_results):
+        if page_data is None:
+            continue
+        
+        # Get document type from extraction
+        doc_type = page_data.get("document_type", "").lower().strip()
+        data = page_data.get("data", page_data)
+        
+        # Normalize document type names
+        doc_type_normalized = normalize_document_type(doc_type, data)
+        
+        # Initialize list for this document type if first occurrence
+        if doc_type_normalized not in doc_pages:
+            doc_pages[doc_type_normalized] = []
+        
+        # Add page data to the appropriate document type
+        doc_pages[doc_type_normalized].append(data)
+        
+        logger.info(f"Page {i+1}: Identified as '{doc_type_normalized}'")
     
     # Merge pages for each document type
     result = {}
@@ -626,6 +995,231 @@ def extract_all_pages(pdf_bytes):
     return result
 
 
+async def extract_all_pages_async(pdf_bytes, max_concurrency=None, mode=None, page_semaphore=None,
+                                  workflow=None, triage=None, early_exit=None):
+    """
+    Generic PDF extraction that supports multiple document types.
+    Rendering and extraction are pipelined: each page is sent to the model as soon as
+    it is ready, while later pages are still rendering. At most max_concurrency
+    (default MAX_CONCURRENT_PAGES) page calls are in flight, and the renderer only
+    runs a few pages ahead, so few page images are held in memory.
+    
+    mode (default EXTRACTION_MODE):
+    - "vision": every page is rendered and sent to GPT-4o Vision
+    - "auto": pages with a native text layer use the text-only extraction call;
+              scanned pages (and text pages whose text call fails) use vision
+    
+    page_semaphore: Optional semaphore shared by several documents (bulk processing),
+                    used instead of a per-document max_concurrency limit.
+    
+    triage (default PAGE_TRIAGE == "on"): classify pages from thumbnails first and skip
+            the full extraction of pages the workflow (override or detected) does not use
+    
+    early_exit (default EARLY_EXIT == "on"): extract pages in priority order (the
+            document types each page is predicted to hold, from triage labels or the
+            text layer keywords) and cancel the remaining page calls as soon as
+            required_documents_extracted() holds
+    
+    Supports:
+    - tax_invoice (Tax Invoice / فاتورة ضريبية)
+    - purchase_order (Purchase Order / أمر الشراء)
+    - gl_document (GL Document / مستند محاسبي)
+    - interim_payment_certificate (IPC / شهادة الدفع المؤقتة)
+    - invoice_submittal_payment_request (Invoice Submittal Payment Request Form)
+    
+    A page that fails to render or extract is logged and skipped; it does not fail the other pages.
+    
+    Blank pages are dropped before rendering, and a page that duplicates an earlier one
+    (same text layer or rendered image, or the same page scanned again, see
+    pdf_renderer.is_duplicate) is not extracted: the earlier page's result stands for
+    both and is merged once. The copy is only extracted if the earlier page fails.
+    
+    Returns: Dictionary with:
+        - document types as keys with extracted data as values
+        - "workflow_type" key indicating which SAP workflow to use
+        - "page_routing" list with the per-page route ("text", "vision", "skipped", "blank",
+          "duplicate" with "duplicate_of", "unselected" beyond the MAX_PAGES budget,
+          "cancelled" by early exit, or "failed")
+        - "failed_pages" list of page numbers that could not be extracted (after retries)
+    """
+    mode = mode or EXTRACTION_MODE
+    early_exit = (EARLY_EXIT == "on") if early_exit is None else early_exit
+    page_count, page_indices, page_hits = await asyncio.to_thread(select_pages_to_process, pdf_bytes, early_exit)
+    observe_document(len(pdf_bytes), len(page_indices))
+    semaphore = page_semaphore or asyncio.Semaphore(max_concurrency or MAX_CONCURRENT_PAGES)
+    page_results = [None] * page_count
+    page_routing = [
+        {"page": i + 1, "route": "failed" if i in page_indices else "unselected"} for i in range(page_count)
+    ]
+    tasks = []
+    
+    triage = (PAGE_TRIAGE == "on") if triage is None else triage
+    page_types = None
+    if triage and len(page_indices) > 1:
+        with trace_stage("triage"):
+            page_types = await triage_pages_async(pdf_bytes, page_count, page_indices)
+        if page_types is not None:
+            selected = set(page_indices)
+            page_indices = [i for i in select_pages_for_workflow(page_types, workflow) if i in selected]
+            for i in selected:
+                page_routing[i]["triage"] = page_types[i]
+                if i not in page_indices:
+                    page_routing[i]["route"] = "skipped"
+            logger.info(f"Triage: extracting {len(page_indices)} of {len(selected)} pages")
+    
+    # Early exit: pages predicted to hold the documents that matter are extracted first
+    predictions = {}
+    if early_exit:
+        for i in page_indices:
+            predictions[i] = (page_types and page_types[i]) or predicted_document_type(page_hits[i])
+        ranked = [i for i in rank_pages(page_hits) if i in predictions]
+        # Unknown pages (scans) before pages known to hold something else
+        priority = {None: len(PAGE_SELECTION_PRIORITY), "other": len(PAGE_SELECTION_PRIORITY) + 1}
+        priority.update({doc_type: rank for rank, doc_type in enumerate(PAGE_SELECTION_PRIORITY)})
+        page_indices = sorted(ranked, key=lambda i: priority.get(predictions[i], len(priority)))
+    finished = {}  # page index -> extracted document type (None when there is no result)
+    exited = asyncio.Event()
+    
+    def page_finished(i, doc_type=None):
+        finished[i] = doc_type
+        if not early_exit or exited.is_set():
+            return
+        outstanding = {j: predictions[j] for j in page_indices if j not in finished}
+        if outstanding and required_documents_extracted(finished, outstanding, workflow):
+            logger.info(f"Early exit: required documents extracted, cancelling {len(outstanding)} pages")
+            exited.set()
+            for task in tasks:
+                if task is not asyncio.current_task():
+                    task.cancel()
+    
+    async def extract_page(i, prepared):
+        routing = page_routing[i]
+        try:
+            with trace_stage("extract", page=i + 1):
+                await extract_prepared_page(i, prepared, routing)
+        except Exception as e:
+            routing["route"] = "failed"
+            logger.error(f"Failed to extract page {i+1}: {e}")
+            page_finished(i)
+            return
+        page = page_results[i]
+        page_finished(i, normalize_document_type(page.get("document_type", "").lower().strip(), page.get("data", page)))
+    
+    def start_page(i, prepared):
+        task = asyncio.create_task(extract_page(i, prepared))
+        # Released by callback: a task cancelled before it starts never runs its body
+        task.add_done_callback(lambda _: semaphore.release())
+        tasks.append(task)
+    
+    async def extract_prepared_page(i, prepared, routing):
+        if prepared["route"] == "text":
+            try:
+                page_results[i] = await extract_invoice_text_data_async(prepared["text"])
+                routing["route"] = "text"
+                return
+            except Exception as e:
+                logger.warning(f"Text extraction failed for page {i+1}, falling back to vision: {e}")
+                routing["fallback"] = "vision"
+                with trace_stage("render", page=i + 1):
+                    prepared["image"] = await asyncio.to_thread(render_single_page, pdf_bytes, i)
+                if prepared["image"] is None:
+                    raise ValueError("page failed to render")
+        
+        page_results[i] = await extract_invoice_data_async(prepared["image"])
+        routing["route"] = "vision"
+    
+    fingerprints = {}  # fingerprint -> index of the first page sent to extraction with it
+    signatures = {}  # page index -> duplicate signature of vision pages sent to extraction
+    duplicates = {}  # page index -> (index of the page it duplicates, prepared copy)
+    
+    try:
+        pages = iter_rendered_pages(pdf_bytes, page_count, text_first=(mode == "auto"), page_indices=page_indices)
+        async with aclosing(pages):
+            async for i, prepared in pages:
+                if exited.is_set():
+                    break
+                if prepared is None:
+                    page_finished(i)
+                    continue
+                record_stage("render", prepared["render_ms"], page=i + 1)
+                page_routing[i].update(
+                    {k: v for k, v in prepared.items()
+                     if k not in ("route", "text", "image", "render_ms", "fingerprint",
+                                  "perceptual_hash", "duplicate_sample")}
+                )
+                if prepared["route"] == "blank":
+                    page_routing[i]["route"] = "blank"
+                    page_finished(i)
+                    continue
+                fingerprint = prepared.get("fingerprint")
+                original = fingerprints.get(fingerprint) if fingerprint is not None else None
+                if original is None and "perceptual_hash" in prepared and signatures:
+                    original = await asyncio.to_thread(find_duplicate, prepared, signatures)
+                if original is not None:
+                    page_routing[i].update({"route": "duplicate", "duplicate_of": original + 1})
+                    duplicates[i] = (original, prepared)
+                    page_finished(i)
+                    continue
+                if fingerprint is not None:
+                    fingerprints[fingerprint] = i
+                if "perceptual_hash" in prepared:
+                    signatures[i] = {k: prepared[k] for k in ("perceptual_hash", "duplicate_sample")}
+                # Wait for a free slot before pulling the next page from the renderer
+                await semaphore.acquire()
+                if exited.is_set():
+                    semaphore.release()
+                    break
+                start_page(i, prepared)
+        
+        # Cancelled (early exit) tasks end with CancelledError; extract_page handles every other error
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # A copy only stands in for its original when the original could not be extracted
+        for i, (original, prepared) in duplicates.items():
+            if page_routing[original]["route"] == "failed" and not exited.is_set():
+                logger.info(f"Page {original+1} failed, extracting its duplicate page {i+1}")
+                del page_routing[i]["duplicate_of"]
+                await semaphore.acquire()
+                start_page(i, prepared)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    
+    if exited.is_set():
+        for i in page_indices:
+            if i not in finished:
+                page_results[i] = None
+                page_routing[i]["route"] = "cancelled"
+    
+    # Results are stored by page index, so grouping sees pages in document order
+    result = group_extracted_pages(page_results)
+    result["page_routing"] = page_routing
+    result["failed_pages"] = [r["page"] for r in page_routing if r["route"] == "failed"]
+    
+    routes = [r["route"] for r in page_routing]
+    logger.info(f"Page routing: {routes.count('text')} text, {routes.count('vision')} vision, "
+                f"{routes.count('skipped')} skipped, {routes.count('blank')} blank, "
+                f"{routes.count('duplicate')} duplicate, {routes.count('unselected')} unselected, "
+                f"{routes.count('cancelled')} cancelled, {routes.count('failed')} failed")
+    rendered = [r for r in page_routing if "image_bytes" in r]
+    if rendered:
+        logger.info(f"Rendered {len(rendered)} pages: {sum(r['image_bytes'] for r in rendered)} bytes, "
+                    f"{sum(r['tiles'] for r in rendered)} tiles "
+                    f"({sum(r.get('tiles_saved', 0) for r in rendered)} saved by the render policy)")
+    
+    return result
+
+
+def extract_all_pages(pdf_bytes):
+    """
+    Sync wrapper around extract_all_pages_async for scripts and thread-pool callers.
+    Must not be called from a thread that is already running an event loop.
+    """
+    return _run_sync(extract_all_pages_async(pdf_bytes))
+
+
 def normalize_document_type(doc_type: str, data: dict) -> str:
     """
     Normalize and validate document type.
@@ -647,18 +1241,10 @@ def normalize_document_type(doc_type: str, data: dict) -> str:
         data_str = json.dumps(data).lower()
         
         # Content-based inference
-        if any(kw in data_str for kw in ["interim", "ipc", "payment certificate", "شهادة الدفع"]):
-            return "interim_payment_certificate"
-        elif any(kw in data_str for kw in ["submittal", "payment request", "طلب دفع"]):
-            return "invoice_submittal_payment_request"
-        elif any(kw in data_str for kw in ["فاتورة", "invoice", "vat", "ضريب"]):
-            return "tax_invoice"
-        elif any(kw in data_str for kw in ["purchase order", "po number", "أمر الشراء"]):
-            return "purchase_order"
-        elif any(kw in data_str for kw in ["gl", "posting", "debit", "credit", "مستند"]):
-            return "gl_document"
-        else:
-            return "unknown"
+        for doc_type_candidate, keywords in DOCUMENT_TYPE_KEYWORDS:
+            if any(kw in data_str for kw in keywords):
+                return doc_type_candidate
+        return "unknown"
     
     return normalized
 
@@ -767,24 +1353,46 @@ def transform_to_final_json(extracted_data: dict) -> dict:
     return transform_to_sap_po_json(extracted_data)
 
 
-def extract_and_transform(pdf_bytes, workflow=None):
+async def extract_and_transform_async(pdf_bytes, workflow=None, use_cache=True, on_stage=None,
+                                      page_semaphore=None):
     """
     Complete pipeline for invoice processing with AUTOMATIC workflow detection:
-    - Layer 1: Extract all pages with OpenAI GPT-4o & merge by document type
+    - Layer 1: Extract all pages concurrently with OpenAI GPT-4o & merge by document type
     - Layer 2: Automatically classify workflow (sap_po or sap_retention)
     - Layer 3: Transform to final structured JSON based on detected workflow
     - Layer 4: Clean up amount separators
     
+    Results are kept in the document cache keyed by the PDF hash, so the same file
+    submitted again (e.g. previewed, then posted) skips all LLM calls.
+    
     Args:
         pdf_bytes: PDF file as bytes
         workflow: Optional workflow override - "sap_po" or "sap_retention"
                  If None, workflow is auto-detected based on documents
+        use_cache: Set False to force a fresh extraction
+        on_stage: Optional callback, called with "extracting" and "transforming"
+                  as the pipeline moves between layers (used for job progress)
+        page_semaphore: Optional page-call budget shared across documents (bulk processing)
     
     Returns:
-        Dictionary with raw_extraction, workflow_type, and final_output
+        Dictionary with raw_extraction, workflow_type, final_output and cached
+        (True when served from the document cache)
     """
+    cache_key = document_cache.make_key(
+        pdf_bytes, workflow or "auto", EXTRACTION_MODE, PAGE_TRIAGE, EARLY_EXIT, TRANSFORM_PROMPT_VERSION
+    )
+    if use_cache:
+        cached = document_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Document cache hit: {cached['workflow_type']}")
+            cached["cached"] = True
+            return cached
+    
     # Layer 1: Extract and group by document type (GENERIC - works for all workflows)
-    extracted_data = extract_all_pages(pdf_bytes)
+    if on_stage:
+        on_stage("extracting")
+    with trace_stage("extract_all_pages"):
+        extracted_data = await extract_all_pages_async(pdf_bytes, page_semaphore=page_semaphore, workflow=workflow)
     
     # Layer 2: Get workflow type (either from auto-classification or manual override)
     workflow_type = workflow if workflow else extracted_data.get("workflow_type", "sap_po")
@@ -792,18 +1400,37 @@ def extract_and_transform(pdf_bytes, workflow=None):
     logger.info(f"Using workflow: {workflow_type}")
     
     # Layer 3: Transform based on workflow type
-    if workflow_type == "sap_po":
-        final_json = transform_to_sap_po_json(extracted_data)
-    elif workflow_type == "sap_retention":
-        final_json = transform_to_sap_retention_json(extracted_data)
-    else:
-        raise ValueError(f"Unknown workflow type: {workflow_type}")
+    if on_stage:
+        on_stage("transforming")
+    with trace_stage("transform"):
+        if workflow_type == "sap_po":
+            final_json = await asyncio.to_thread(transform_to_sap_po_json, extracted_data)
+        elif workflow_type == "sap_retention":
+            final_json = await asyncio.to_thread(transform_to_sap_retention_json, extracted_data)
+        else:
+            raise ValueError(f"Unknown workflow type: {workflow_type}")
     
     # Layer 4: Clean up amount separators
     final_json = remove_amount_separators(final_json)
     
-    return {
+    result = {
         "raw_extraction": extracted_data,
         "workflow_type": workflow_type,
         "final_output": final_json
-    }
\ No newline at end of file
+    }
+    if extracted_data["failed_pages"]:
+        # A missing page can change the detected workflow; do not serve this result again
+        logger.warning(f"Pages {extracted_data['failed_pages']} failed to extract; result not cached")
+    else:
+        document_cache.set(cache_key, result)
+    result["cached"] = False
+    
+    return result
+
+
+def extract_and_transform(pdf_bytes, workflow=None):
+    """
+    Sync wrapper around extract_and_transform_async (see there for the pipeline layers).
+    Must not be called from a thread that is already running an event loop.
+    """
+    return _run_sync(extract_and_transform_async(pdf_bytes, workflow))
@@ -2,9 +2,12 @@ import asyncio
 import json
 import os
 import base64
+import io
+import zipfile
+from typing import List
 from email.mime.text import MIMEText
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request as HTTPRequest
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
@@ -15,11 +18,24 @@ from Invoice_extractor import (
     transform_to_final_json,
     transform_to_sap_retention_json,
     extract_and_transform,
+    extract_and_transform_async,
     extract_all_pages,
+    extract_all_pages_async,
     pdf_to_base64_images,
     encode_image,
     remove_amount_separators
 )
+from pdf_renderer import shutdown_render_pool
+from sap_client import SapCsrfSession, CsrfTokenError
+from jobs import JobManager, JobQueueFull
+from pipeline_trace import pipeline_trace, trace_stage
+from metrics import (
+    track_provider_call,
+    render_latest,
+    http_requests_total,
+    http_request_duration_seconds,
+    http_requests_in_flight,
+)
 
 app = FastAPI(title="Invoice Extractor API")
 
@@ -33,10 +49,41 @@ app.add_middleware(
 
 import httpx  
 import asyncio
+import time
 import warnings
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
 
+@app.middleware("http")
+async def record_request_metrics(request: HTTPRequest, call_next):
+    """Request count, latency and in-flight gauge for every endpoint (labelled by route template)."""
+    started = time.perf_counter()
+    status = 500
+    http_requests_in_flight.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_requests_in_flight.dec()
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        http_requests_total.labels(endpoint=endpoint, method=request.method, status=str(status)).inc()
+        http_request_duration_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - started)
+
+@app.on_event("startup")
+async def start_workers():
+    """Start the invoice job worker pool."""
+    await job_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop job workers and the PDF render process pool, and close pooled SAP connections."""
+    await job_manager.stop()
+    shutdown_render_pool()
+    await sap_miro_session.close()
+    await sap_retention_session.close()
+
 # Suppress SSL warnings since SAP APIs use self-signed certificates
 warnings.filterwarnings("ignore", message="Unverified HTTPS request")
 
@@ -54,17 +101,35 @@ warnings.filterwarnings("ignore", message="Unverified HTTPS request")
 # ===============================================================================
 
 # SAP Purchase Order Configuration (MIRO API)
-SAP_MIRO_URL = "https://asd.al-akaria.com/sap/bc/zmiro_post_po?sap-client=110"
+# SAP_HOST can point at a stand-in SAP server (see benchmarks/mock_services.py)
+SAP_HOST = os.getenv("SAP_HOST", "https://asd.al-akaria.com")
+SAP_MIRO_URL = f"{SAP_HOST}/sap/bc/zmiro_post_po?sap-client=110"
 SAP_MIRO_AUTH = ("ohussain", "Skr@@244343P")
 
 # SAP Retention Configuration (F-43 API)
-SAP_RETENTION_BASE_URL = "https://asd.al-akaria.com/sap/opu/odata/sap/ZFI_F_43_API_SRV"
+SAP_RETENTION_BASE_URL = f"{SAP_HOST}/sap/opu/odata/sap/ZFI_F_43_API_SRV"
 SAP_RETENTION_ENTITY = "FHeaderSet"
 SAP_RETENTION_CLIENT = "110"
 SAP_RETENTION_GET_URL = f"{SAP_RETENTION_BASE_URL}/{SAP_RETENTION_ENTITY}?sap-client={SAP_RETENTION_CLIENT}&$format=json"
 SAP_RETENTION_POST_URL = f"{SAP_RETENTION_BASE_URL}/{SAP_RETENTION_ENTITY}?sap-client={SAP_RETENTION_CLIENT}"
 SAP_RETENTION_AUTH = ("OHUSSAIN", "Skr@@244343P")
 
+# App-lifetime pooled SAP connections with CSRF token reuse (closed on shutdown)
+sap_miro_session = SapCsrfSession(SAP_MIRO_URL, SAP_MIRO_AUTH)
+sap_retention_session = SapCsrfSession(
+    SAP_RETENTION_GET_URL,
+    SAP_RETENTION_AUTH,
+    fetch_headers={"Accept": "application/json"},
+    timeout=30.0
+)
+
+# Bulk processing: documents in flight at once, and the page extraction budget
+# shared by all of them (rendering is already bounded by the render process pool)
+BULK_MAX_CONCURRENT_DOCUMENTS = int(os.getenv("BULK_MAX_CONCURRENT_DOCUMENTS", 8))
+BULK_MAX_CONCURRENT_PAGES = int(os.getenv("BULK_MAX_CONCURRENT_PAGES", 16))
+BULK_MAX_DOCUMENTS = int(os.getenv("BULK_MAX_DOCUMENTS", 500))
+BULK_MAX_UNZIPPED_MB = int(os.getenv("BULK_MAX_UNZIPPED_MB", 1024))
+
 # Legacy compatibility
 SAP_URL = SAP_MIRO_URL
 SAP_AUTH = SAP_MIRO_AUTH
@@ -168,29 +233,22 @@ def format_sap_payload(final_output: dict):
 async def hit_sap_miro_api(payload: dict):
     """
     SAP PURCHASE ORDER (MIRO API) - POST handler
-    Handles the 2-step SAP authentication handshake.
-    1. GET call to fetch X-CSRF-Token.
+    Handles the 2-step SAP authentication handshake over the pooled MIRO session.
+    1. X-CSRF-Token is fetched once and reused (refetched only if SAP rejects it).
     2. POST call with the token and payload.
     """
-    async with httpx.AsyncClient(auth=SAP_MIRO_AUTH, verify=False) as client:
-        try:
-            # Step 1: Fetch CSRF Token
-            fetch_res = await client.get(SAP_MIRO_URL, headers={"x-csrf-token": "fetch"})
-            csrf_token = fetch_res.headers.get("x-csrf-token")
-            
-            if not csrf_token:
-                return {"error": "Failed to fetch X-CSRF-Token from SAP MIRO"}
-
-            # Step 2: POST the formatted data
-            headers = {
-                "x-csrf-token": csrf_token,
-                "Content-Type": "application/json"
-            }
-            
-            sap_res = await client.post(SAP_MIRO_URL, headers=headers, json=payload)
-            return sap_res.json()
-        except Exception as e:
-            return {"error": f"SAP MIRO Connection Failed: {str(e)}"}
+    try:
+        with track_provider_call("sap", "miro"):
+            sap_res = await sap_miro_session.post(
+                SAP_MIRO_URL,
+                payload,
+                headers={"Content-Type": "application/json"}
+            )
+        return sap_res.json()
+    except CsrfTokenError:
+        return {"error": "Failed to fetch X-CSRF-Token from SAP MIRO"}
+    except Exception as e:
+        return {"error": f"SAP MIRO Connection Failed: {str(e)}"}
 
 
 def format_sap_retention_payload(final_output: dict):
@@ -227,78 +285,128 @@ async def hit_sap_retention_api(payload: dict):
     """
     SAP RETENTION (F-43 API) - POST handler
     
-    Handles the 2-step SAP authentication handshake for F-43 API:
-    1. GET call to fetch X-CSRF-Token (with $format=json)
+    Handles the 2-step SAP authentication handshake for F-43 API over the pooled session:
+    1. X-CSRF-Token is fetched once with GET ($format=json) and reused across postings
+       (refetched only if SAP answers 403 "CSRF token validation failed")
     2. POST call with the token and payload
     
     Matches the working logic from test_sap_retention_api.py
     """
-    async with httpx.AsyncClient(
-        auth=SAP_RETENTION_AUTH, 
-        verify=False,
-        timeout=30.0
-    ) as client:
-        try:
-            # Step 1: Fetch CSRF Token (using GET with $format=json)
-            fetch_res = await client.get(
-                SAP_RETENTION_GET_URL,
+    try:
+        with track_provider_call("sap", "f43"):
+            sap_res = await sap_retention_session.post(
+                SAP_RETENTION_POST_URL,
+                payload,
                 headers={
-                    "x-csrf-token": "fetch",
+                    "Content-Type": "application/json",
                     "Accept": "application/json"
                 }
             )
+        
+        # Handle response based on content type
+        content_type = sap_res.headers.get("Content-Type", "")
+        
+        if "application/json" in content_type:
+            response_json = sap_res.json()
             
-            csrf_token = fetch_res.headers.get("x-csrf-token")
-            
-            if not csrf_token:
+            # Success detection
+            if sap_res.status_code in [200, 201]:
+                return response_json
+            else:
+                # SAP returned error in JSON format
                 return {
-                    "error": "Failed to fetch X-CSRF-Token from SAP Retention API",
-                    "status_code": fetch_res.status_code,
-                    "response": fetch_res.text
+                    "error": "SAP returned an error",
+                    "status_code": sap_res.status_code,
+                    "sap_response": response_json
                 }
-
-            # Step 2: POST the formatted data
-            headers = {
-                "x-csrf-token": csrf_token,
-                "Content-Type": "application/json",
-                "Accept": "application/json"
+        else:
+            # SAP returned XML error (non-JSON)
+            return {
+                "error": "SAP returned non-JSON response",
+                "status_code": sap_res.status_code,
+                "raw_response": sap_res.text
             }
+    
+    except CsrfTokenError as e:
+        return {
+            "error": "Failed to fetch X-CSRF-Token from SAP Retention API",
+            "status_code": e.response.status_code,
+            "response": e.response.text
+        }
+    except Exception as e:
+        return {
+            "error": f"SAP Retention API Connection Failed: {str(e)}",
+            "error_type": type(e).__name__
+        }
+
+async def run_invoice_pipeline(pdf_bytes: bytes, on_stage=None, page_semaphore=None,
+                               include_timings=False) -> dict:
+    """
+    Complete invoice pipeline shared by /extract-and-transform, the job workers and
+    the bulk endpoint: Extract → Classify → Transform → Post to SAP → Email.
+    
+    on_stage, if given, is called with the name of each stage as it starts.
+    page_semaphore, if given, is a page-call budget shared with other documents.
+    include_timings adds the per-stage/per-page latency and token breakdown as "timings"
+    (it is always written to the structured logs).
+    """
+    with pipeline_trace("extract-and-transform", pdf_bytes=len(pdf_bytes)) as trace:
+        # Complete pipeline: Extract → Classify → Transform (automatic based on workflow)
+        # A file that was just previewed via /sap-data is served from the document cache
+        result = await extract_and_transform_async(pdf_bytes, on_stage=on_stage, page_semaphore=page_semaphore)
+    
+        workflow_type = result.get("workflow_type", "sap_po")
+
+        # Post to appropriate SAP API based on detected workflow
+        if "final_output" in result:
+            if on_stage:
+                on_stage("posting_to_sap")
+            if workflow_type == "sap_po":
+                # SAP Purchase Order workflow (MIRO API)
+                sap_payload = format_sap_payload(result["final_output"])
+                with trace_stage("sap_miro_post"):
+                    sap_status = await hit_sap_miro_api(sap_payload)
             
-            sap_res = await client.post(
-                SAP_RETENTION_POST_URL, 
-                headers=headers, 
-                json=payload
-            )
-            
-            # Handle response based on content type
-            content_type = sap_res.headers.get("Content-Type", "")
+            elif workflow_type == "sap_retention":
+                # SAP Retention workflow (F-43 API)
+                sap_payload = format_sap_retention_payload(result["final_output"])
+                with trace_stage("sap_retention_post"):
+                    sap_status = await hit_sap_retention_api(sap_payload)
             
-            if "application/json" in content_type:
-                response_json = sap_res.json()
-                
-                # Success detection
-                if sap_res.status_code in [200, 201]:
-                    return response_json
-                else:
-                    # SAP returned error in JSON format
-                    return {
-                        "error": "SAP returned an error",
-                        "status_code": sap_res.status_code,
-                        "sap_response": response_json
-                    }
             else:
-                # SAP returned XML error (non-JSON)
-                return {
-                    "error": "SAP returned non-JSON response",
-                    "status_code": sap_res.status_code,
-                    "raw_response": sap_res.text
-                }
+                raise ValueError(f"Unknown workflow type: {workflow_type}")
+        
+            # Append the SAP response to output
+            result["sap_posting_response"] = sap_status
+        
+            # Send email ONLY if SAP posting was successful
+            if sap_status and "error" not in sap_status:
+                # For SAP PO: look for "invoice" field
+                # For SAP Retention: look for document number in response (nested in "d" object)
+                invoice_number = (
+                    sap_status.get("invoice", "").strip() or  # SAP PO
+                    sap_status.get("DOC_NO", "").strip() or   # SAP Retention (direct)
+                    sap_status.get("d", {}).get("DOC_NO", "").strip()  # SAP Retention (nested)
+                )
             
-        except Exception as e:
-            return {
-                "error": f"SAP Retention API Connection Failed: {str(e)}",
-                "error_type": type(e).__name__
-            }
+                # Only send email if document number exists and is not empty
+                if invoice_number:
+                    if on_stage:
+                        on_stage("sending_email")
+                    # Gmail client is blocking; keep it off the event loop
+                    with trace_stage("gmail_send"), track_provider_call("gmail", "send"):
+                        email_result = await asyncio.to_thread(send_invoice_success_email, invoice_number)
+                    result["email_notification"] = email_result
+
+    if include_timings:
+        result["timings"] = trace.summary()
+
+    return result
+
+
+# In-process worker pool for /jobs/* (started and stopped with the app)
+job_manager = JobManager(run_invoice_pipeline)
+
 
 @app.get("/")
 async def root():
@@ -323,6 +431,16 @@ async def root():
                 "method": "POST", 
                 "description": "TESTING - Generate SAP payload without posting",
                 "use_case": "Test and validate transformations before production"
+            },
+            "/jobs/extract-and-transform": {
+                "method": "POST",
+                "description": "ASYNC - Queue the production pipeline and return a job ID immediately",
+                "use_case": "Long-running invoices without holding the HTTP connection open; poll /jobs/{job_id}"
+            },
+            "/bulk/extract-and-transform": {
+                "method": "POST",
+                "description": "BULK - Many PDFs or ZIP archives, results streamed as NDJSON per document",
+                "use_case": "Month-end batches under one shared rendering and LLM concurrency budget"
             }
         },
         "features": [
@@ -335,8 +453,19 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus metrics: request/stage/provider latency histograms, in-flight gauges,
+    page-count and PDF-size distributions, cache lookups and errors by type.
+    Aggregated across gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
+
+
 @app.post("/extract-and-transform")
-async def process_invoice(file: UploadFile = File(...)):
+async def process_invoice(file: UploadFile = File(...), timings: bool = False):
     """
     UNIFIED INVOICE PROCESSING ENDPOINT - Automatic Workflow Detection & Posting
     
@@ -362,60 +491,66 @@ async def process_invoice(file: UploadFile = File(...)):
     - Sends notification email if posting successful
     
     The entire process is AUTOMATIC - no manual workflow selection needed!
+    
+    Pass ?timings=true to include the per-stage latency and token breakdown.
     """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
 
     try:
         pdf_bytes = await file.read()
-
-        # Complete pipeline: Extract → Classify → Transform (automatic based on workflow)
-        result = await asyncio.to_thread(extract_and_transform, pdf_bytes)
-        
-        workflow_type = result.get("workflow_type", "sap_po")
-
-        # Post to appropriate SAP API based on detected workflow
-        if "final_output" in result:
-            if workflow_type == "sap_po":
-                # SAP Purchase Order workflow (MIRO API)
-                sap_payload = format_sap_payload(result["final_output"])
-                sap_status = await hit_sap_miro_api(sap_payload)
-                
-            elif workflow_type == "sap_retention":
-                # SAP Retention workflow (F-43 API)
-                sap_payload = format_sap_retention_payload(result["final_output"])
-                sap_status = await hit_sap_retention_api(sap_payload)
-                
-            else:
-                raise ValueError(f"Unknown workflow type: {workflow_type}")
-            
-            # Append the SAP response to output
-            result["sap_posting_response"] = sap_status
-            
-            # Send email ONLY if SAP posting was successful
-            if sap_status and "error" not in sap_status:
-                # For SAP PO: look for "invoice" field
-                # For SAP Retention: look for document number in response (nested in "d" object)
-                invoice_number = (
-                    sap_status.get("invoice", "").strip() or  # SAP PO
-                    sap_status.get("DOC_NO", "").strip() or   # SAP Retention (direct)
-                    sap_status.get("d", {}).get("DOC_NO", "").strip()  # SAP Retention (nested)
-                )
-                
-                # Only send email if document number exists and is not empty
-                if invoice_number:
-                    email_result = send_invoice_success_email(invoice_number)
-                    result["email_notification"] = email_result
-
+        result = await run_invoice_pipeline(pdf_bytes, include_timings=timings)
         return JSONResponse(content=result)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/jobs/extract-and-transform", status_code=202)
+async def submit_invoice_job(file: UploadFile = File(...)):
+    """
+    ASYNC JOB SUBMISSION - Same pipeline as /extract-and-transform, without holding the connection
+    
+    Queues the PDF and returns a job ID immediately. A bounded worker pool inside the
+    service runs Extract → Transform → Post to SAP → Email; poll /jobs/{job_id} for
+    per-stage progress and the final result (same shape as /extract-and-transform).
+    
+    Returns 503 when the job queue is full.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    pdf_bytes = await file.read()
+    try:
+        job = job_manager.submit(pdf_bytes, filename=file.filename)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['job_id']}"
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_invoice_job(job_id: str):
+    """
+    JOB STATUS - Progress and result of a job submitted to /jobs/extract-and-transform
+    
+    status: queued | running | succeeded | failed
+    stage: current pipeline stage (extracting, transforming, posting_to_sap, sending_email)
+    stages: timeline of completed and running stages
+    result: pipeline output once succeeded; error: message once failed
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 
 @app.post("/sap-data")
-async def preview_payload(file: UploadFile = File(...)):
+async def preview_payload(file: UploadFile = File(...), timings: bool = False):
     """
     TESTING ENDPOINT - Preview SAP Payload WITHOUT Posting
     
@@ -433,6 +568,8 @@ async def preview_payload(file: UploadFile = File(...)):
     - Debug transformation issues
     
     Perfect for testing before using /process-invoice in production!
+    
+    Pass ?timings=true to include the per-stage latency and token breakdown.
     """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
@@ -440,31 +577,19 @@ async def preview_payload(file: UploadFile = File(...)):
     try:
         pdf_bytes = await file.read()
 
-        # Step 1: Extract raw data with workflow classification
-        extracted_data = await asyncio.to_thread(extract_all_pages, pdf_bytes)
+        # Steps 1-2: Extract, classify and transform. The result is kept in the
+        # document cache, so posting the same file next skips straight to SAP.
+        with pipeline_trace("sap-data", pdf_bytes=len(pdf_bytes)) as trace:
+            result = await extract_and_transform_async(pdf_bytes)
         
-        workflow_type = extracted_data.get("workflow_type", "sap_po")
+        workflow_type = result["workflow_type"]
+        extracted_data = result["raw_extraction"]
+        final_output = result["final_output"]
         
-        # Step 2: Transform to final JSON based on workflow
         if workflow_type == "sap_po":
-            final_output = await asyncio.to_thread(transform_to_final_json, extracted_data)
-            final_output = remove_amount_separators(final_output)
             sap_payload = format_sap_payload(final_output)
-            
         elif workflow_type == "sap_retention":
-            # SAP Retention transformation (will use your logic once provided)
-            try:
-                final_output = await asyncio.to_thread(transform_to_sap_retention_json, extracted_data)
-                final_output = remove_amount_separators(final_output)
-                sap_payload = format_sap_retention_payload(final_output)
-            except NotImplementedError:
-                return JSONResponse(content={
-                    "status": "info",
-                    "workflow_type": workflow_type,
-                    "message": "SAP Retention workflow detected. Transformation logic pending.",
-                    "extracted_data": extracted_data,
-                    "note": "Waiting for transformation logic to be implemented in next prompt."
-                })
+            sap_payload = format_sap_retention_payload(final_output)
         else:
             raise ValueError(f"Unknown workflow type: {workflow_type}")
 
@@ -475,8 +600,107 @@ async def preview_payload(file: UploadFile = File(...)):
             "message": f"{workflow_type.upper()} payload generated (not posted to SAP)",
             "sap_payload": sap_payload,
             "extracted_data": extracted_data,
-            "final_output": final_output
+            "final_output": final_output,
+            "cached": result["cached"],
+            **({"timings": trace.summary()} if timings else {})
         })
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def read_bulk_documents(files: List[UploadFile]) -> list:
+    """
+    Expand a bulk upload into (filename, pdf_bytes) pairs.
+    Accepts PDFs and ZIP archives of PDFs; anything else is rejected with 400.
+    """
+    documents = []
+    for upload in files:
+        data = await upload.read()
+        name = upload.filename or "upload"
+
+        if data.startswith(b"%PDF"):
+            documents.append((name, data))
+        elif zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                members = [
+                    info for info in archive.infolist()
+                    if not info.is_dir()
+                    and info.filename.lower().endswith(".pdf")
+                    and not info.filename.startswith("__MACOSX/")
+                ]
+                if sum(info.file_size for info in members) > BULK_MAX_UNZIPPED_MB * 1024 * 1024:
+                    raise HTTPException(status_code=400, detail=f"{name}: archive exceeds {BULK_MAX_UNZIPPED_MB} MB uncompressed")
+                for info in members:
+                    documents.append((f"{name}/{info.filename}", archive.read(info)))
+        else:
+            raise HTTPException(status_code=400, detail=f"{name}: only PDF files and ZIP archives are supported")
+
+        if len(documents) > BULK_MAX_DOCUMENTS:
+            raise HTTPException(status_code=400, detail=f"Too many documents (max {BULK_MAX_DOCUMENTS})")
+
+    if not documents:
+        raise HTTPException(status_code=400, detail="No PDF documents found in upload")
+    return documents
+
+
+async def stream_bulk_results(documents: list, post_to_sap: bool):
+    """
+    Run every document through the pipeline under one shared concurrency budget and
+    yield one NDJSON line per document as it finishes, then a summary line.
+    """
+    page_semaphore = asyncio.Semaphore(BULK_MAX_CONCURRENT_PAGES)
+    document_semaphore = asyncio.Semaphore(BULK_MAX_CONCURRENT_DOCUMENTS)
+
+    async def process(filename, pdf_bytes):
+        async with document_semaphore:
+            try:
+                if post_to_sap:
+                    result = await run_invoice_pipeline(pdf_bytes, page_semaphore=page_semaphore)
+                else:
+                    result = await extract_and_transform_async(pdf_bytes, page_semaphore=page_semaphore)
+                return {"filename": filename, "status": "succeeded", "result": result}
+            except Exception as e:
+                return {"filename": filename, "status": "failed", "error": str(e)}
+
+    tasks = [asyncio.create_task(process(name, data)) for name, data in documents]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            succeeded += line["status"] == "succeeded"
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+        yield json.dumps({"summary": {
+            "documents": len(documents),
+            "succeeded": succeeded,
+            "failed": len(documents) - succeeded
+        }}) + "\n"
+    finally:
+        # Client went away early: stop outstanding previews. Postings are left to finish,
+        # since cancelling mid-request would leave the SAP outcome unknown.
+        if not post_to_sap:
+            for task in tasks:
+                task.cancel()
+
+
+@app.post("/bulk/extract-and-transform")
+async def process_invoice_bulk(files: List[UploadFile] = File(...), post_to_sap: bool = True):
+    """
+    BULK INVOICE PROCESSING - Many PDFs (or ZIP archives of PDFs) in one request
+    
+    All pages of all documents are scheduled through one global concurrency budget
+    (BULK_MAX_CONCURRENT_DOCUMENTS documents, BULK_MAX_CONCURRENT_PAGES page calls),
+    and results are streamed back as NDJSON, one line per document as it finishes:
+    
+        {"filename": "...", "status": "succeeded", "result": {...}}
+        {"filename": "...", "status": "failed", "error": "..."}
+        {"summary": {"documents": N, "succeeded": N, "failed": N}}
+    
+    post_to_sap=false generates the SAP payloads without posting (like /sap-data).
+    """
+    documents = await read_bulk_documents(files)
+    return StreamingResponse(
+        stream_bulk_results(documents, post_to_sap),
+        media_type="application/x-ndjson"
+    )
@@ -0,0 +1,250 @@
+"""
+Local stand-ins for the external services used by the invoice pipeline:
+
+- OpenAI chat completions   POST /v1/chat/completions (page extraction, page triage, transforms)
+- Groq chat completions     POST /openai/v1/chat/completions
+- SAP MIRO                  GET (CSRF fetch) + POST /sap/bc/zmiro_post_po
+- SAP F-43                  GET (CSRF fetch) + POST /sap/opu/odata/sap/ZFI_F_43_API_SRV/FHeaderSet
+
+Each service has a configurable latency distribution (log-normal around a median)
+and error rate, so the pipeline can be benchmarked offline at realistic timings.
+
+Usage:
+    python benchmarks/mock_services.py --port 9100 --llm-latency-ms 1500 --llm-error-rate 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Invoice pipeline mock services")
+
+CONFIG = {
+    "llm_latency_ms": 1200.0,
+    "llm_latency_sigma": 0.35,
+    "llm_error_rate": 0.0,
+    "sap_latency_ms": 300.0,
+    "sap_latency_sigma": 0.25,
+    "sap_error_rate": 0.0,
+}
+
+CSRF_TOKEN = "mock-csrf-token"
+
+# Canned page extractions; a page's type is chosen from a hash of its content
+PAGE_EXTRACTIONS = [
+    {
+        "document_type": "tax_invoice",
+        "data": {
+            "Invoice No": "INV/2024/00180",
+            "Invoice Date": "23/12/2024",
+            "items": [
+                {"No": "1", "Description": "Civil works", "Quantity": "1", "Unit": "LS", "Amount": "40,000.00"},
+                {"No": "2", "Description": "Electrical works", "Quantity": "2", "Unit": "EA", "Amount": "4,165.34"},
+            ],
+            "Total before VAT": "44,165.34",
+            "VAT 15%": "6,624.80",
+            "Total including VAT": "50,790.14",
+            "Retention 10%": "4,416.53",
+            "Net Payable": "46,373.61",
+        },
+    },
+    {
+        "document_type": "purchase_order",
+        "data": {"PO Number": "3160000018", "items": [{"Item": "10", "Description": "Civil works", "Quantity": "1"}]},
+    },
+    {
+        "document_type": "invoice_submittal_payment_request",
+        "data": {"Supplier Code (SAP)": "23001045", "Request Person": "Procurement"},
+    },
+]
+
+TRIAGE_TYPES = [page["document_type"] for page in PAGE_EXTRACTIONS] + ["other"]
+
+SAP_PO_OUTPUT = {
+    "docDate": "20241223",
+    "postingDate": "20241223",
+    "refDocno": "INV/2024/00180",
+    "companyCode": "2000",
+    "currency": "SAR",
+    "grossAmount": "50790.14",
+    "item": [
+        {"invoiceDocItem": "000001", "poNumber": "3160000018", "poItem": "00010", "quantity": "1",
+         "unit": "LS", "itemAmount": "40000.00", "sheetNo": ""},
+        {"invoiceDocItem": "000002", "poNumber": "3160000018", "poItem": "00020", "quantity": "2",
+         "unit": "EA", "itemAmount": "4165.34", "sheetNo": ""},
+    ],
+}
+
+
+def _retention_line(line_no, **fields):
+    line = {
+        "DOC_NO": "1", "POSTING_KEY": "", "LINE_NO": str(line_no), "VENDOR": "", "ACCOUNT": "",
+        "SPECIAL_GL_INDICATOR": "", "AMOUNT": "", "ORDER": "", "TAX_CODE": "", "TAX": "",
+        "ASSIGNMENT": "", "WBS_ELEMENT": "",
+    }
+    line.update(fields)
+    return line
+
+
+SAP_RETENTION_OUTPUT = {
+    "DOC_NO": "1",
+    "REF_DOC_NO": "INV/2024/00180",
+    "COMPANY_CODE": "2000",
+    "FISCAL_YEAR": "2026",
+    "FISCAL_PERIOD": "01",
+    "DOCUMENT_DATE": "23.12.2024",
+    "DOC_TYPE": "KR",
+    "HDRTOITEMNAV": [
+        _retention_line(1, POSTING_KEY="31", VENDOR="23001045", AMOUNT="46373.61"),
+        _retention_line(2, POSTING_KEY="39", VENDOR="23001045", SPECIAL_GL_INDICATOR="R", AMOUNT="4416.53"),
+        _retention_line(3, POSTING_KEY="40", ACCOUNT="5114004", AMOUNT="44165.34", ORDER="11200341", TAX_CODE="31"),
+        _retention_line(4, ACCOUNT="1242001", AMOUNT="6624.80", TAX_CODE="31", TAX="X"),
+    ],
+}
+
+
+async def _simulate(service):
+    """Sleep for a sampled latency; return an error response with the configured probability."""
+    median = CONFIG[f"{service}_latency_ms"] / 1000
+    await asyncio.sleep(median * random.lognormvariate(0, CONFIG[f"{service}_latency_sigma"]))
+    if random.random() < CONFIG[f"{service}_error_rate"]:
+        if random.random() < 0.5:
+            return JSONResponse(status_code=429, headers={"Retry-After": "1"},
+                                content={"error": {"message": "Rate limit reached (mock)", "type": "rate_limit"}})
+        return JSONResponse(status_code=500, content={"error": {"message": "Internal error (mock)", "type": "server_error"}})
+    return None
+
+
+def _prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    parts.append(part["text"])
+                elif part.get("type") == "image_url":
+                    parts.append(part["image_url"]["url"])
+    return "\n".join(parts)
+
+
+def _triage_reply(prompt):
+    """Label each "Page N:" of a triage request with a page type chosen from a hash of its thumbnail."""
+    pages = []
+    for match in re.finditer(r"Page (\d+):\n(\S+)", prompt):
+        digest = int(hashlib.sha256(match.group(2).encode("utf-8")).hexdigest(), 16)
+        pages.append({"page": int(match.group(1)), "document_type": TRIAGE_TYPES[digest % len(TRIAGE_TYPES)]})
+    return json.dumps({"pages": pages})
+
+
+def _reply_for(prompt):
+    """Pick a canned reply matching the kind of pipeline call."""
+    if "classifying the pages" in prompt:
+        return _triage_reply(prompt)
+    if "HDRTOITEMNAV" in prompt:
+        return json.dumps(SAP_RETENTION_OUTPUT)
+    if "docDate" in prompt:
+        return json.dumps(SAP_PO_OUTPUT)
+    if "simple_retention" in prompt:
+        return "simple_retention"
+    digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    return json.dumps(PAGE_EXTRACTIONS[digest % len(PAGE_EXTRACTIONS)], ensure_ascii=False)
+
+
+async def _chat_completion(request: Request):
+    error = await _simulate("llm")
+    if error is not None:
+        return error
+
+    body = await request.json()
+    prompt = _prompt_text(body.get("messages", []))
+    content = _reply_for(prompt)
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        },
+    }
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    return await _chat_completion(request)
+
+
+@app.post("/openai/v1/chat/completions")
+async def groq_chat_completions(request: Request):
+    return await _chat_completion(request)
+
+
+async def _sap_post(request: Request, success_body):
+    error = await _simulate("sap")
+    if error is not None:
+        return error
+    if request.headers.get("x-csrf-token") != CSRF_TOKEN:
+        return JSONResponse(status_code=403, headers={"x-csrf-token": "Required"},
+                            content={"error": "CSRF token validation failed"})
+    return JSONResponse(status_code=201, content=success_body)
+
+
+async def _sap_csrf_fetch():
+    error = await _simulate("sap")
+    if error is not None:
+        return error
+    return JSONResponse(content={"d": {"results": []}}, headers={"x-csrf-token": CSRF_TOKEN})
+
+
+@app.get("/sap/bc/zmiro_post_po")
+async def sap_miro_fetch():
+    return await _sap_csrf_fetch()
+
+
+@app.post("/sap/bc/zmiro_post_po")
+async def sap_miro_post(request: Request):
+    return await _sap_post(request, {"invoice": f"51056{random.randint(10000, 99999)}", "status": "S"})
+
+
+@app.get("/sap/opu/odata/sap/ZFI_F_43_API_SRV/FHeaderSet")
+async def sap_retention_fetch():
+    return await _sap_csrf_fetch()
+
+
+@app.post("/sap/opu/odata/sap/ZFI_F_43_API_SRV/FHeaderSet")
+async def sap_retention_post(request: Request):
+    return await _sap_post(request, {"d": {"DOC_NO": f"19000{random.randint(10000, 99999)}"}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for key, value in CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=value)
+    args = parser.parse_args()
+    for key in CONFIG:
+        CONFIG[key] = getattr(args, key)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
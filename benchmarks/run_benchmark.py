@@ -0,0 +1,279 @@
+"""
+Offline throughput/latency benchmark for the invoice API.
+
+Starts the mock OpenAI/Groq/SAP services (benchmarks/mock_services.py) and the API
+(uvicorn api:app) pointed at them, generates a corpus of synthetic invoice PDFs, drives
+/extract-and-transform and /sap-data at a fixed concurrency and reports throughput,
+p50/p95/p99 latency and peak RSS of the API process tree. No real LLM or SAP calls are made.
+
+Usage:
+    python benchmarks/run_benchmark.py --requests 40 --concurrency 4 --pages 6
+    python benchmarks/run_benchmark.py --llm-latency-ms 2000 --llm-error-rate 0.05 --json-out bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ["/extract-and-transform", "/sap-data"]
+
+
+# -------------------------
+# Synthetic corpus
+# -------------------------
+def make_invoice_pdf(pages, scanned=False, seed=0):
+    """
+    Build a synthetic invoice pack: a tax invoice page, a purchase order page and filler
+    annex pages with tables. scanned=True flattens every page to an image (no text layer).
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page(width=595, height=842)
+        if page_no == 0:
+            title = "TAX INVOICE"
+        elif page_no == 1:
+            title = "PURCHASE ORDER"
+        else:
+            title = f"ANNEX {page_no - 1}"
+        page.insert_text((50, 60), title, fontsize=20)
+        page.insert_text((50, 90), f"Invoice No: INV/2024/{rng.randint(100, 999):05d}", fontsize=11)
+        page.insert_text((50, 108), f"PO Number: 3160{rng.randint(100000, 999999)}", fontsize=11)
+        y = 140
+        for row in range(rng.randint(10, 30)):
+            amount = rng.uniform(100, 50000)
+            page.insert_text((50, y), f"{row + 1:>3}  Item description {rng.randint(1, 999):>4}", fontsize=9)
+            page.insert_text((400, y), f"{amount:>12,.2f}", fontsize=9)
+            y += 14
+        page.draw_rect(fitz.Rect(45, 125, 550, y), color=(0, 0, 0), width=0.5)
+
+    if scanned:
+        flat = fitz.open()
+        for page in doc:
+            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
+            new_page = flat.new_page(width=page.rect.width, height=page.rect.height)
+            new_page.insert_image(new_page.rect, stream=pix.tobytes("jpg"))
+        doc = flat
+
+    return doc.tobytes()
+
+
+def build_corpus(size, max_pages, scanned_ratio, seed):
+    rng = random.Random(seed)
+    return [
+        make_invoice_pdf(rng.randint(2, max_pages), scanned=rng.random() < scanned_ratio, seed=seed + i)
+        for i in range(size)
+    ]
+
+
+# -------------------------
+# Process management
+# -------------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Service on port {port} did not start within {timeout}s")
+
+
+def start_mock_services(port, args):
+    cmd = [
+        sys.executable, os.path.join(REPO_ROOT, "benchmarks", "mock_services.py"), "--port", str(port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--llm-error-rate", str(args.llm_error_rate),
+        "--sap-latency-ms", str(args.sap_latency_ms), "--sap-error-rate", str(args.sap_error_rate),
+    ]
+    return subprocess.Popen(cmd)
+
+
+def start_api(port, mock_port, args, workdir):
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_ROOT,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "GROQ_API_KEY": "gsk-benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "GROQ_BASE_URL": f"http://127.0.0.1:{mock_port}",
+        "SAP_HOST": f"http://127.0.0.1:{mock_port}",
+    }
+    if not args.with_caches:
+        # Measure the pipeline itself, not cache hits on a repeated corpus
+        env.update({"EXTRACTION_CACHE_SIZE": "0", "EXTRACTION_CACHE_DB": "", "DOCUMENT_CACHE_SIZE": "0"})
+    env.update(dict(item.split("=", 1) for item in args.env))
+    cmd = [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning"]
+    # Run from an empty directory so no real Gmail token.json / credentials are picked up
+    return subprocess.Popen(cmd, env=env, cwd=workdir)
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+
+
+def _rss_kb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree_rss_mb(pid, field="VmRSS:"):
+    """RSS of a process and all its descendants (the render pool workers), in MB (Linux only)."""
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _rss_kb(current, field)
+        stack.extend(_children(current))
+    return total / 1024
+
+
+# -------------------------
+# Load generation
+# -------------------------
+async def drive(api_port, corpus, endpoints, total_requests, concurrency, rss_probe):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(client, n):
+        endpoint = endpoints[n % len(endpoints)]
+        pdf = corpus[n % len(corpus)]
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(endpoint, files={"file": (f"invoice_{n}.pdf", pdf, "application/pdf")})
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            results.append({"endpoint": endpoint, "seconds": time.perf_counter() - started, "ok": ok})
+
+    async def sample_rss(stop):
+        while not stop.is_set():
+            rss_probe()
+            await asyncio.sleep(0.2)
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(stop))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=600) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, n) for n in range(total_requests)))
+        elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+    return results, elapsed
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(results, elapsed, peak_rss_mb):
+    def stats(rows):
+        latencies = [r["seconds"] for r in rows]
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if not r["ok"]),
+            "p50_s": round(percentile(latencies, 50), 3),
+            "p95_s": round(percentile(latencies, 95), 3),
+            "p99_s": round(percentile(latencies, 99), 3),
+            "mean_s": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        }
+
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "overall": stats(results),
+        "by_endpoint": {
+            endpoint: stats([r for r in results if r["endpoint"] == endpoint])
+            for endpoint in sorted({r["endpoint"] for r in results})
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="total requests to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--corpus-size", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=6, help="maximum pages per synthetic PDF")
+    parser.add_argument("--scanned-ratio", type=float, default=0.5, help="fraction of PDFs without a text layer")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, action="append",
+                        help="endpoint(s) to drive (default: both)")
+    parser.add_argument("--llm-latency-ms", type=float, default=1200)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--sap-latency-ms", type=float, default=300)
+    parser.add_argument("--sap-error-rate", type=float, default=0.0)
+    parser.add_argument("--with-caches", action="store_true", help="keep page/document caches enabled")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the API process (e.g. EXTRACTION_MODE=auto)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json-out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_size, args.pages, args.scanned_ratio, args.seed)
+    mock_port, api_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+
+    mock = start_mock_services(mock_port, args)
+    api = start_api(api_port, mock_port, args, workdir)
+    peak = {"rss_mb": 0.0}
+
+    def rss_probe():
+        peak["rss_mb"] = max(peak["rss_mb"], process_tree_rss_mb(api.pid))
+
+    try:
+        wait_for_port(mock_port)
+        wait_for_port(api_port)
+        results, elapsed = asyncio.run(
+            drive(api_port, corpus, args.endpoint or ENDPOINTS, args.requests, args.concurrency, rss_probe)
+        )
+        # The API process's own high-water mark catches peaks between samples
+        peak["rss_mb"] = max(peak["rss_mb"], _rss_kb(api.pid, "VmHWM:") / 1024)
+    finally:
+        api.terminate()
+        mock.terminate()
+        api.wait(timeout=10)
+        mock.wait(timeout=10)
+
+    report = summarize(results, elapsed, peak["rss_mb"])
+    report["config"] = {k: v for k, v in vars(args).items() if k != "json_out"}
+    print(json.dumps(report, indent=2))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
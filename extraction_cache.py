@@ -0,0 +1,227 @@
+import copy
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# In-memory LRU tier size (number of pages). 0 disables the memory tier.
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", 256))
+# Optional on-disk SQLite tier. Empty disables it.
+EXTRACTION_CACHE_DB = os.getenv("EXTRACTION_CACHE_DB", "")
+EXTRACTION_CACHE_DB_MAX_MB = int(os.getenv("EXTRACTION_CACHE_DB_MAX_MB", 256))
+# Whole-document pipeline results (extraction + transform), keyed by PDF hash
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", 64))
+DOCUMENT_CACHE_TTL_SECONDS = int(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", 1800))
+
+
+def make_cache_key(payload: bytes, fingerprint: str) -> str:
+    """
+    Content-addressed cache key: SHA-256 over the prompt fingerprint and the page payload
+    (rendered image bytes or page text). Changing the prompt or model changes every key.
+    """
+    digest = hashlib.sha256()
+    digest.update(fingerprint.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+def make_fingerprint(*parts) -> str:
+    """Short stable fingerprint of everything that influences a model reply (prompt, model, params)."""
+    return hashlib.sha256("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+
+
+class PageExtractionCache:
+    """
+    Two-tier cache for per-page extraction results (JSON text).
+
+    - Memory tier: LRU bounded by entry count.
+    - Disk tier (optional): SQLite file bounded by total value size, least recently
+      used rows evicted first. Shared by every worker process pointing at the same file.
+
+    Thread-safe; all state is guarded by a single lock.
+    """
+
+    def __init__(self, max_entries=EXTRACTION_CACHE_SIZE, db_path=EXTRACTION_CACHE_DB,
+                 db_max_bytes=EXTRACTION_CACHE_DB_MAX_MB * 1024 * 1024, name="page"):
+        self.name = name
+        self.max_entries = max_entries
+        self.db_max_bytes = db_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS page_cache ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                    " size INTEGER NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS page_cache_accessed ON page_cache(accessed)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to open extraction cache DB {db_path}: {e}")
+                self._db = None
+
+    def get(self, key: str):
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                record_cache_lookup(self.name, hit=True)
+                return self._memory[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT value FROM page_cache WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        self._db.execute("UPDATE page_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+                        self._db.commit()
+                        self._remember(key, row[0])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        record_cache_lookup(self.name, hit=True)
+                        return row[0]
+                except sqlite3.Error as e:
+                    logger.error(f"Extraction cache DB read failed: {e}")
+
+            self.misses += 1
+            record_cache_lookup(self.name, hit=False)
+            return None
+
+    def set(self, key: str, value: str):
+        """Store value in both tiers, evicting least recently used entries as needed."""
+        with self._lock:
+            self._remember(key, value)
+
+            if self._db is not None:
+                try:
+                    size = len(value.encode("utf-8"))
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO page_cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                        (key, value, size, time.time()),
+                    )
+                    self._evict_disk()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Extraction cache DB write failed: {e}")
+
+    def stats(self) -> dict:
+        """Hit/miss counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_enabled": self._db is not None,
+            }
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM page_cache").fetchone()[0]
+        if total <= self.db_max_bytes:
+            return
+        # Walk rows oldest-first until enough bytes are freed
+        excess = total - self.db_max_bytes
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM page_cache ORDER BY accessed ASC").fetchall():
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM page_cache WHERE key = ?", stale)
+        logger.info(f"Extraction cache evicted {len(stale)} page(s) from disk tier")
+
+
+class DocumentResultCache:
+    """
+    Bounded, TTL-expiring store of pipeline results (raw_extraction, workflow_type,
+    final_output) keyed by the SHA-256 of the uploaded PDF.
+
+    Lets /extract-and-transform post a file that /sap-data just previewed without
+    re-running extraction and transformation. Values are deep-copied in and out,
+    since callers add SAP and email responses to the result they get back.
+    """
+
+    def __init__(self, max_entries=DOCUMENT_CACHE_SIZE, ttl_seconds=DOCUMENT_CACHE_TTL_SECONDS,
+                 name="document"):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(pdf_bytes: bytes, *variant) -> str:
+        """PDF content hash, plus anything else that changes the result (workflow override, mode)."""
+        key = hashlib.sha256(pdf_bytes).hexdigest()
+        return ":".join([key, *(str(v) for v in variant)])
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache_lookup(self.name, hit=True)
+                return copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            record_cache_lookup(self.name, hit=False)
+            return None
+
+    def set(self, key: str, value: dict):
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+# Process-wide cache in front of extract_invoice_data
+page_cache = PageExtractionCache()
+
+# Process-wide cache in front of extract_and_transform
+document_cache = DocumentResultCache()
@@ -0,0 +1,19 @@
+# gunicorn.conf.py
+# Loaded automatically by gunicorn from the working directory (see Dockerfile CMD).
+import os
+import shutil
+
+
+def on_starting(server):
+    """Start every deployment with an empty Prometheus multiprocess directory."""
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop live gauges (in-flight counts) of a worker that has exited."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# Invoices processed concurrently by the in-process worker pool
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Submissions beyond this many waiting jobs are rejected (HTTP 503)
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 100))
+# Finished jobs are kept this long for status polling
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", 3600))
+
+
+class JobQueueFull(Exception):
+    """The job queue is at JOB_QUEUE_SIZE; the client should retry later."""
+
+
+class JobManager:
+    """
+    In-process job queue and bounded worker pool for long-running invoice pipelines.
+
+    submit() returns immediately with a job record; JOB_WORKERS asyncio workers run
+    handler(pdf_bytes, on_stage) for queued jobs, and the handler reports progress
+    by calling on_stage(name). Job state lives in this process only, so the job API
+    expects a single gunicorn worker (or sticky routing) for status polling.
+    """
+
+    def __init__(self, handler, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE,
+                 ttl_seconds=JOB_RESULT_TTL_SECONDS):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Job workers started: {self.workers}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, pdf_bytes, filename=None) -> dict:
+        """Queue a PDF for processing and return its job record."""
+        self._prune()
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "status": "queued",
+            "stage": "queued",
+            "stages": [],
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        try:
+            self._queue.put_nowait((job_id, pdf_bytes))
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self.max_queued} waiting)")
+        self._jobs[job_id] = job
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self, worker_no):
+        while True:
+            job_id, pdf_bytes = await self._queue.get()
+            job = self._jobs.get(job_id)
+            try:
+                if job is not None:
+                    await self._run(job, pdf_bytes)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job, pdf_bytes):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+
+        def on_stage(stage):
+            # Close the previous stage and open the next one
+            now = time.time()
+            if job["stages"]:
+                job["stages"][-1]["finished_at"] = now
+            job["stages"].append({"stage": stage, "started_at": now, "finished_at": None})
+            job["stage"] = stage
+
+        try:
+            job["result"] = await self.handler(pdf_bytes, on_stage)
+            job["status"] = "succeeded"
+        except Exception as e:
+            logger.error(f"Job {job['job_id']} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.time()
+            if job["stages"]:
+                job["stages"][-1]["finished_at"] = job["finished_at"]
+            job["stage"] = job["status"]
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from openai.types.chat import ChatCompletion
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# "off": normal API calls. "record": API calls, and every request/response is appended
+# to the cassette. "replay": responses are served from the cassette, no network access.
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+
+# Request arguments that do not change the model's reply
+_TRANSPORT_ARGS = {"timeout", "extra_headers"}
+
+
+class CassetteMiss(Exception):
+    """Replay mode found no recorded response for a request."""
+
+
+def request_key(provider, kwargs) -> str:
+    """Stable hash of everything in a chat completion request that determines the reply."""
+    request = {k: v for k, v in kwargs.items() if k not in _TRANSPORT_ARGS}
+    canonical = json.dumps({"provider": provider, **request}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCassette:
+    """
+    JSONL record/replay store for chat completion calls (OpenAI and Groq).
+
+    Each line holds the request key, provider, pipeline stage, the full request and the
+    response. Replay indexes the file by request key on first use; identical requests
+    recorded several times are replayed in recorded order (then the last one repeats).
+    """
+
+    def __init__(self, path=LLM_CASSETTE_PATH, mode=LLM_CASSETTE_MODE):
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._index = None
+        self._served = {}
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def record(self, provider, stage, kwargs, response):
+        entry = {
+            "key": request_key(provider, kwargs),
+            "provider": provider,
+            "stage": stage,
+            "recorded_at": time.time(),
+            "request": {k: v for k, v in kwargs.items() if k not in _TRANSPORT_ARGS},
+            "response": response.model_dump(mode="json"),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def replay(self, provider, kwargs) -> ChatCompletion:
+        key = request_key(provider, kwargs)
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_index()
+            responses = self._index.get(key)
+            if not responses:
+                raise CassetteMiss(f"No recorded {provider} response for request {key[:12]} (model={kwargs.get('model')})")
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+            data = responses[min(served, len(responses) - 1)]
+        return ChatCompletion.model_validate(data)
+
+    def _load_index(self):
+        index = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping malformed cassette line {line_no} in {self.path}")
+                        continue
+                    index.setdefault(entry["key"], []).append(entry["response"])
+        except FileNotFoundError:
+            logger.error(f"LLM cassette {self.path} not found; every replayed call will miss")
+        logger.info(f"Loaded LLM cassette {self.path}: {len(index)} distinct requests")
+        return index
+
+
+# Process-wide cassette used by the LLM call wrappers in Invoice_extractor
+llm_cassette = LLMCassette()
@@ -0,0 +1,215 @@
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import groq
+import openai
+
+from metrics import record_llm_retry, record_llm_hedge
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# Retries after the first attempt, on 429 / 5xx / connection errors / attempt timeouts
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+# Full-jitter exponential backoff: sleep uniform(0, min(max, base * 2**retry)).
+# A Retry-After header from the provider is honored instead (capped at the max).
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20))
+# Deadline for a single attempt, and for the call as a whole (all attempts and backoff)
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", 90))
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", 240))
+# Hedging (async calls only): when an attempt is still running after this percentile of
+# recent successful latencies for the same model and stage, a duplicate request is sent
+# and the first reply wins. 0 disables hedging.
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 0))
+# Latency samples needed before hedging starts, and the cap on hedged calls
+# as a fraction of all calls (bounds the extra cost)
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", 0.1))
+
+_RETRYABLE_STATUS = {408, 409, 429}
+_CONNECTION_ERRORS = (openai.APIConnectionError, groq.APIConnectionError, asyncio.TimeoutError, TimeoutError)
+
+
+class LLMDeadlineExceeded(Exception):
+    """An LLM call did not succeed within LLM_CALL_DEADLINE_SECONDS."""
+
+
+def retry_reason(error):
+    """Short reason label when `error` is worth retrying, else None."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        if status in _RETRYABLE_STATUS or status >= 500:
+            return str(status)
+        return None
+    if isinstance(error, _CONNECTION_ERRORS):
+        return "timeout" if "timeout" in type(error).__name__.lower() else "connection"
+    return None
+
+
+def retry_after_seconds(error):
+    """Delay requested by the provider (retry-after-ms / retry-after headers), or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(retry, error):
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return min(retry_after, LLM_BACKOFF_MAX_SECONDS)
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** retry))
+
+
+class LatencyTracker:
+    """Recent successful call latencies per (model, stage), for the hedging threshold."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, key):
+        """Seconds to wait before hedging a call, or None when hedging is off or out of budget."""
+        with self._lock:
+            self._calls += 1
+            if LLM_HEDGE_PERCENTILE <= 0 or self._hedges >= LLM_HEDGE_MAX_RATIO * self._calls:
+                return None
+            samples = self._samples.get(key)
+            if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(LLM_HEDGE_PERCENTILE / 100 * len(ordered)))]
+
+    def count_hedge(self):
+        with self._lock:
+            self._hedges += 1
+
+
+latency_tracker = LatencyTracker()
+
+
+def _attempt_timeout(started):
+    remaining = LLM_CALL_DEADLINE_SECONDS - (time.monotonic() - started)
+    if remaining <= 0:
+        raise LLMDeadlineExceeded(f"LLM call exceeded its {LLM_CALL_DEADLINE_SECONDS:.0f}s deadline")
+    return min(LLM_ATTEMPT_TIMEOUT_SECONDS, remaining)
+
+
+def _next_delay(retry, error, started, provider, model):
+    """Backoff before retry number `retry`, or None when the error is final."""
+    reason = retry_reason(error)
+    if reason is None or retry >= LLM_MAX_RETRIES:
+        return None
+    delay = backoff_delay(retry, error)
+    if time.monotonic() - started + delay >= LLM_CALL_DEADLINE_SECONDS:
+        return None
+    record_llm_retry(provider, model, reason)
+    logger.warning(f"{provider} {model} call failed ({reason}), retry {retry + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+    return delay
+
+
+def call_with_retries(attempt, provider, model, stage):
+    """
+    Run `attempt(timeout)` (one sync LLM request) with backoff retries on transient
+    errors, each attempt bounded by its timeout and all of them by the call deadline.
+    """
+    started = time.monotonic()
+    retry = 0
+    while True:
+        attempt_started = time.monotonic()
+        try:
+            response = attempt(_attempt_timeout(started))
+        except LLMDeadlineExceeded:
+            raise
+        except Exception as e:
+            delay = _next_delay(retry, e, started, provider, model)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            retry += 1
+            continue
+        latency_tracker.observe((model, stage), time.monotonic() - attempt_started)
+        return response
+
+
+async def _hedged(attempt, timeout, provider, model, stage):
+    """One attempt, duplicated once if it runs past the hedging threshold; the first success wins."""
+    started = time.monotonic()
+    key = (model, stage)
+    primary = asyncio.ensure_future(asyncio.wait_for(attempt(timeout), timeout))
+    tasks = [primary]
+    try:
+        delay = latency_tracker.hedge_delay(key)
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                latency_tracker.count_hedge()
+                remaining = timeout - delay
+                tasks.append(asyncio.ensure_future(asyncio.wait_for(attempt(remaining), remaining)))
+
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if len(tasks) > 1:
+                    record_llm_hedge(provider, model, won=task is not primary)
+                latency_tracker.observe(key, time.monotonic() - started)
+                return task.result()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def acall_with_retries(attempt, provider, model, stage):
+    """Async counterpart of call_with_retries; `attempt(timeout)` is a coroutine function. Adds hedging."""
+    started = time.monotonic()
+    retry = 0
+    while True:
+        try:
+            return await _hedged(attempt, _attempt_timeout(started), provider, model, stage)
+        except LLMDeadlineExceeded:
+            raise
+        except Exception as e:
+            delay = _next_delay(retry, e, started, provider, model)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            retry += 1
@@ -0,0 +1,162 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+# -------------------------
+# Prometheus metrics
+# -------------------------
+# With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR (see Dockerfile and
+# gunicorn.conf.py): every worker writes its samples there and /metrics aggregates
+# all of them, whichever worker serves the scrape.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 300)
+
+http_requests_total = Counter(
+    "invoice_http_requests_total", "HTTP requests handled", ["endpoint", "method", "status"]
+)
+http_request_duration_seconds = Histogram(
+    "invoice_http_request_duration_seconds", "HTTP request latency", ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+http_requests_in_flight = Gauge(
+    "invoice_http_requests_in_flight", "HTTP requests currently being handled",
+    multiprocess_mode="livesum",
+)
+stage_duration_seconds = Histogram(
+    "invoice_pipeline_stage_duration_seconds", "Pipeline stage latency", ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+provider_request_duration_seconds = Histogram(
+    "invoice_provider_request_duration_seconds",
+    "Latency of calls to external providers (OpenAI, Groq, SAP, Gmail)",
+    ["provider", "target"],
+    buckets=LATENCY_BUCKETS,
+)
+provider_requests_in_flight = Gauge(
+    "invoice_provider_requests_in_flight", "External provider calls currently in flight",
+    ["provider", "target"],
+    multiprocess_mode="livesum",
+)
+llm_tokens_total = Counter(
+    "invoice_llm_tokens_total", "LLM tokens by kind (prompt, completion, cached)",
+    ["provider", "target", "kind"],
+)
+pdf_pages = Histogram(
+    "invoice_pdf_pages", "Pages processed per PDF",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64),
+)
+pdf_size_bytes = Histogram(
+    "invoice_pdf_size_bytes", "Uploaded PDF size",
+    buckets=(50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6),
+)
+llm_rate_limit_wait_seconds = Histogram(
+    "invoice_llm_rate_limit_wait_seconds", "Time LLM calls queued for the shared rate limit budget",
+    ["target"],
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+llm_retries_total = Counter(
+    "invoice_llm_retries_total", "LLM call retries by provider, model and reason (status code, timeout, connection)",
+    ["provider", "target", "reason"],
+)
+llm_hedges_total = Counter(
+    "invoice_llm_hedges_total", "Hedged LLM calls by which request replied first (primary, hedge)",
+    ["provider", "target", "winner"],
+)
+llm_prompt_tokens_saved_total = Counter(
+    "invoice_llm_prompt_tokens_saved_total", "Prompt tokens saved by pruning transform payloads (estimated)",
+    ["stage"],
+)
+cache_lookups_total = Counter(
+    "invoice_cache_lookups_total", "Cache lookups by cache and result (hit, miss)",
+    ["cache", "result"],
+)
+errors_total = Counter(
+    "invoice_errors_total", "Errors by stage and exception type", ["stage", "type"]
+)
+
+
+def record_error(stage, error):
+    errors_total.labels(stage=stage, type=type(error).__name__).inc()
+
+
+def observe_stage(stage, seconds):
+    stage_duration_seconds.labels(stage=stage).observe(seconds)
+
+
+def observe_document(pdf_size, page_count):
+    pdf_size_bytes.observe(pdf_size)
+    pdf_pages.observe(page_count)
+
+
+def record_cache_lookup(cache, hit):
+    cache_lookups_total.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def observe_llm_usage(provider, target, response):
+    """Count the prompt/completion/cached tokens reported in an LLM response."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    for kind, value in (
+        ("prompt", getattr(usage, "prompt_tokens", 0)),
+        ("completion", getattr(usage, "completion_tokens", 0)),
+        ("cached", getattr(details, "cached_tokens", 0)),
+    ):
+        if value:
+            llm_tokens_total.labels(provider=provider, target=target, kind=kind).inc(value)
+
+
+def observe_rate_limit_wait(target, seconds):
+    llm_rate_limit_wait_seconds.labels(target=target).observe(seconds)
+
+
+def record_llm_retry(provider, target, reason):
+    llm_retries_total.labels(provider=provider, target=target, reason=reason).inc()
+
+
+def record_llm_hedge(provider, target, won):
+    llm_hedges_total.labels(provider=provider, target=target, winner="hedge" if won else "primary").inc()
+
+
+def record_prompt_tokens_saved(stage, tokens):
+    if tokens:
+        llm_prompt_tokens_saved_total.labels(stage=stage).inc(tokens)
+
+
+@contextmanager
+def track_provider_call(provider, target):
+    """Time one external call and count it as in flight; failures are counted by exception type."""
+    in_flight = provider_requests_in_flight.labels(provider=provider, target=target)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_error(f"{provider}:{target}", e)
+        raise
+    finally:
+        in_flight.dec()
+        provider_request_duration_seconds.labels(provider=provider, target=target).observe(
+            time.perf_counter() - started
+        )
+
+
+def render_latest():
+    """Exposition payload for /metrics, aggregated across workers in multiprocess mode."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,139 @@
+import re
+
+# Page selection and ordering decisions that need no PDF or model access: keyword
+# ranking from the text layer, triage-based selection and the early-exit check.
+
+# Document types each workflow's transform reads (see project_for_workflow)
+WORKFLOW_DOCUMENT_TYPES = {
+    "sap_po": {"tax_invoice", "purchase_order"},
+    "sap_retention": {"tax_invoice", "invoice_submittal_payment_request", "interim_payment_certificate"},
+}
+
+
+def select_pages_for_workflow(page_types, workflow=None):
+    """
+    Page indices worth a full extraction, given triage labels: pages of the document
+    types the workflow uses, plus unlabelled pages. The workflow is sap_po when any
+    page looks like a purchase order (as classify_workflow will decide), else
+    sap_retention. When no page looks like a tax invoice, triage is not trusted and
+    every page is selected.
+    """
+    if "tax_invoice" not in page_types:
+        return list(range(len(page_types)))
+    workflow = workflow or ("sap_po" if "purchase_order" in page_types else "sap_retention")
+    needed = WORKFLOW_DOCUMENT_TYPES[workflow]
+    return [i for i, page_type in enumerate(page_types) if page_type is None or page_type in needed]
+
+
+# Keywords identifying each document type, in the order normalize_document_type
+# tries them. Also used to rank pages of long PDFs by their text layer.
+DOCUMENT_TYPE_KEYWORDS = [
+    ("interim_payment_certificate", ["interim", "ipc", "payment certificate", "شهادة الدفع"]),
+    ("invoice_submittal_payment_request", ["submittal", "payment request", "طلب دفع"]),
+    ("tax_invoice", ["فاتورة", "invoice", "vat", "ضريب"]),
+    ("purchase_order", ["purchase order", "po number", "أمر الشراء"]),
+    ("gl_document", ["gl", "posting", "debit", "credit", "مستند"]),
+]
+
+# The page picked first for each document type when the page budget is short
+PAGE_SELECTION_PRIORITY = [
+    "tax_invoice", "purchase_order", "interim_payment_certificate",
+    "invoice_submittal_payment_request", "gl_document",
+]
+
+# Pages with less native text than this cannot be ranked (scans)
+PAGE_RANKING_MIN_CHARS = 20
+
+_KEYWORD_PATTERNS = {
+    doc_type: [
+        # Latin keywords as whole words ("gl" must not match "english");
+        # Arabic ones as substrings, since they take prefixes (الفاتورة)
+        re.compile(rf"\b{re.escape(kw)}\b" if kw.isascii() else re.escape(kw))
+        for kw in keywords
+    ]
+    for doc_type, keywords in DOCUMENT_TYPE_KEYWORDS
+}
+
+
+def page_keyword_hits(text):
+    """Keyword occurrences per document type in a page's text, or None if the page has no usable text layer."""
+    if len(text.strip()) < PAGE_RANKING_MIN_CHARS:
+        return None
+    text = text.lower()
+    return {
+        doc_type: sum(len(pattern.findall(text)) for pattern in patterns)
+        for doc_type, patterns in _KEYWORD_PATTERNS.items()
+    }
+
+
+def rank_pages(page_hits):
+    """
+    Order pages by how much they are worth extracting, given page_keyword_hits() per page:
+
+    1. the page with the most keyword hits for each document type (PAGE_SELECTION_PRIORITY order)
+    2. other pages with keyword hits, most hits first (continuation and summary pages)
+    3. pages without a text layer, in page order (scans: their content is unknown)
+    4. the remaining pages, in page order
+    """
+    ranked = []
+    for doc_type in PAGE_SELECTION_PRIORITY:
+        candidates = [i for i, hits in enumerate(page_hits) if hits and hits[doc_type]]
+        if candidates:
+            best = max(candidates, key=lambda i: (page_hits[i][doc_type], -i))
+            if best not in ranked:
+                ranked.append(best)
+    ranked += sorted(
+        (i for i, hits in enumerate(page_hits) if hits and any(hits.values()) and i not in ranked),
+        key=lambda i: -sum(page_hits[i].values()),
+    )
+    ranked += [i for i, hits in enumerate(page_hits) if hits is None]
+    ranked += [i for i in range(len(page_hits)) if i not in ranked]
+    return ranked
+
+
+def required_documents_extracted(finished, outstanding, workflow=None):
+    """
+    Whether the remaining page calls can be cancelled (EARLY_EXIT).
+
+    finished: {page index: normalized document type} for pages done (None for pages
+              that failed, were blank or duplicates)
+    outstanding: {page index: predicted document type or None} for pages not done yet
+
+    The workflow is sap_po once a purchase order is extracted; sap_retention only when
+    no outstanding page may be one (as classify_workflow would decide). Then:
+    - the tax invoice (and for sap_po the purchase order) has been extracted
+    - no outstanding page is predicted to hold a document type the workflow uses, or
+      is of unknown type (None: no text layer and no triage label)
+    - the pages either side of every extracted page of those types are done, so a
+      multi-page document (continuation, payment summary) is complete
+    """
+    found = set(finished.values())
+    if workflow is None:
+        if "purchase_order" in found:
+            workflow = "sap_po"
+        elif any(doc_type in ("purchase_order", None) for doc_type in outstanding.values()):
+            return False
+        else:
+            workflow = "sap_retention"
+    needed = WORKFLOW_DOCUMENT_TYPES[workflow]
+    required = {"tax_invoice", "purchase_order"} if workflow == "sap_po" else {"tax_invoice"}
+    if not required <= found:
+        return False
+    # An unknown page (scan without a triage label) may be a later page of a needed document
+    if any(doc_type is None or doc_type in needed for doc_type in outstanding.values()):
+        return False
+    order = sorted({**finished, **outstanding})
+    for position, i in enumerate(order):
+        if finished.get(i) in needed:
+            neighbours = order[max(position - 1, 0):position] + order[position + 1:position + 2]
+            if any(j in outstanding for j in neighbours):
+                return False
+    return True
+
+
+def predicted_document_type(hits):
+    """Document type a page most likely holds, from page_keyword_hits(); None when unknown (no text layer)."""
+    if hits is None:
+        return None
+    doc_type, count = max(hits.items(), key=lambda item: item[1])
+    return doc_type if count else "other"
@@ -0,0 +1,612 @@
+import asyncio
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+RENDER_ZOOM = 1.5
+# "adaptive": zoom, colorspace and JPEG quality chosen per page (see render_policy).
+# "fixed": every page at RENDER_ZOOM, RGB, default JPEG quality.
+RENDER_POLICY = os.getenv("RENDER_POLICY", "adaptive")
+# The vision model downscales images so the shortest side is at most 768 px (after fitting
+# into 2048x2048) and bills 512 px tiles; rendering beyond that only adds upload bytes.
+RENDER_TARGET_SHORT_SIDE = int(os.getenv("RENDER_TARGET_SHORT_SIDE", 768))
+RENDER_MAX_LONG_SIDE = int(os.getenv("RENDER_MAX_LONG_SIDE", 2048))
+# Pages without a text layer and with less ink than this (see ink_coverage) render
+# smaller: a 512 px short side takes an A4 page from 6 tiles to 2. Only near-empty pages (a stamp, a signature) qualify; any readable amount of
+# body text, and any page with a text layer, keeps RENDER_TARGET_SHORT_SIDE.
+RENDER_SPARSE_MAX_INK = float(os.getenv("RENDER_SPARSE_MAX_INK", 0.002))
+RENDER_SPARSE_SHORT_SIDE = int(os.getenv("RENDER_SPARSE_SHORT_SIDE", 512))
+RENDER_MIN_ZOOM = float(os.getenv("RENDER_MIN_ZOOM", 0.75))
+RENDER_MAX_ZOOM = float(os.getenv("RENDER_MAX_ZOOM", 2.5))
+# JPEG quality steps down from the start value until the page fits the byte budget
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", 85))
+RENDER_JPEG_MIN_QUALITY = int(os.getenv("RENDER_JPEG_MIN_QUALITY", 55))
+RENDER_MAX_BYTES = int(os.getenv("RENDER_MAX_BYTES", 300_000))
+# Also encode each page the fixed way to report exact bytes saved (costs a second render)
+RENDER_MEASURE_SAVINGS = os.getenv("RENDER_MEASURE_SAVINGS", "off") == "on"
+# Blank / duplicate page filter: a page without a text layer and with less ink than
+# BLANK_PAGE_MAX_INK is dropped before rendering. A page whose rendered image or text
+# layer is identical to an earlier page's, or that is the same page scanned again
+# (see is_duplicate), is extracted once. "off" extracts every page.
+PAGE_FILTER = os.getenv("PAGE_FILTER", "on") == "on"
+# Each vision page is sampled once at zoom 1.0 (A4 ~600x840 px, where 9pt text is
+# still ~6 px tall); ink, color and the duplicate signature all come from that sample.
+INK_SAMPLE_ZOOM = 1.0
+# Scan artifacts are not ink: the outer INK_MARGIN of each side (scanner borders, punch
+# holes, staple shadows) is ignored, and dark pixels only count in INK_CELL-pixel cells
+# holding at least INK_CELL_MIN_DARK of them (isolated specks and dust do not).
+INK_MARGIN = float(os.getenv("INK_MARGIN", 0.08))
+INK_CELL = 8
+INK_CELL_MIN_DARK = int(os.getenv("INK_CELL_MIN_DARK", 6))
+# Borders, punch holes and specks of a scanned blank page then measure 0; 0.0005 is
+# ~200 px on A4 (a page number or a smudge), below a stamp, a signature or a text line.
+BLANK_PAGE_MAX_INK = float(os.getenv("BLANK_PAGE_MAX_INK", 0.0005))
+# Same page scanned again: perceptual hashes within DUPLICATE_MAX_DISTANCE bits (of 256;
+# a rescan offset by ~6 px lands ~30 bits apart, a page with other content ~60+),
+# confirmed by the ink masks matching pixel for pixel once aligned within
+# DUPLICATE_MAX_SHIFT px (see is_duplicate).
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", 32))
+DUPLICATE_MAX_SHIFT = int(os.getenv("DUPLICATE_MAX_SHIFT", 6))
+# Thumbnails for the page triage pass (~300x420 px for A4), sent at detail "low"
+THUMBNAIL_ZOOM = float(os.getenv("THUMBNAIL_ZOOM", 0.5))
+THUMBNAIL_JPEG_QUALITY = int(os.getenv("THUMBNAIL_JPEG_QUALITY", 60))
+# Worker processes for page rasterization. 1 renders in-process.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+# Below this many pages the pool's IPC overhead outweighs the parallelism
+RENDER_PARALLEL_MIN_PAGES = int(os.getenv("RENDER_PARALLEL_MIN_PAGES", 3))
+# Pages rendered ahead of the consumer when streaming (bounds images held in memory)
+RENDER_PREFETCH = int(os.getenv("RENDER_PREFETCH", 2))
+# Text-layer routing: a page needs at least this many characters of native text...
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", 200))
+# ...and embedded images (scans, photos) covering no more than this fraction of the page
+TEXT_LAYER_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", 0.5))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """
+    Return the app-lifetime render pool, creating it on first use.
+    Uses the "spawn" start method: forking a process that runs an event loop
+    and HTTP client threads is not safe.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _discard_render_pool(pool):
+    """
+    Drop a render pool whose worker died (BrokenProcessPool), so the next
+    get_render_pool() call starts a fresh one instead of failing forever.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_render_pool():
+    """Stop the render pool worker processes (called on app shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def vision_tiles(width, height):
+    """512 px tiles the vision model bills for a width x height image at detail "high"."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def page_samples(page):
+    """
+    RGB sample of the page at INK_SAMPLE_ZOOM. Rendered once per page and shared by the
+    color, ink and duplicate measurements below. Returns: uint8 array (height, width, 3).
+    """
+    pix = page.get_pixmap(matrix=fitz.Matrix(INK_SAMPLE_ZOOM, INK_SAMPLE_ZOOM), colorspace=fitz.csRGB, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+
+
+def _grayscale(samples):
+    return samples.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _cell_sums(values, cell):
+    """Sum an image over cell x cell pixel blocks (a partial last row / column of cells is dropped)."""
+    height, width = (values.shape[0] // cell) * cell, (values.shape[1] // cell) * cell
+    return values[:height, :width].reshape(height // cell, cell, width // cell, cell, *values.shape[2:]).sum(axis=(1, 3))
+
+
+def _area_average(gray, height, width):
+    """Average a grayscale image down to height x width cells (at least one pixel each)."""
+    rows = np.linspace(0, gray.shape[0], height + 1).astype(int)
+    cols = np.linspace(0, gray.shape[1], width + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(gray, rows[:-1], axis=0), cols[:-1], axis=1)
+    return sums / np.outer(np.diff(rows), np.diff(cols))
+
+
+def is_monochrome(samples, color_threshold=24, max_color_fraction=0.002):
+    """
+    Whether (almost) no part of a page sample is colored. Judged on 5x5 pixel cell
+    averages, so scanner color noise does not count.
+    """
+    cells = _cell_sums(samples.astype(np.int32), 5) / 25
+    spread = cells.max(axis=2) - cells.min(axis=2)
+    return float(np.mean(spread > color_threshold)) <= max_color_fraction
+
+
+def _inside_margins(gray):
+    """The part of a grayscale page sample inside INK_MARGIN."""
+    height, width = gray.shape
+    top, left = int(height * INK_MARGIN), int(width * INK_MARGIN)
+    return gray[top:height - top, left:width - left]
+
+
+def _dilate(mask):
+    """Grow a boolean mask by one pixel in every direction."""
+    height, width = mask.shape
+    padded = np.pad(mask, 1)
+    grown = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            grown |= padded[dy:dy + height, dx:dx + width]
+    return grown
+
+
+def ink_coverage(samples):
+    """
+    Ink coverage of a page sample, ignoring scan artifacts (see INK_MARGIN).
+    Returns: fraction of the area inside the margins covered by dark pixels that count.
+    """
+    dark = _inside_margins(_grayscale(samples)) < 160
+    if not dark.size:
+        return 0.0
+    cells = _cell_sums(dark.astype(np.int32), INK_CELL)
+    return float(cells[cells >= INK_CELL_MIN_DARK].sum() / dark.size)
+
+
+def perceptual_hash(gray, size=16, step=2):
+    """
+    Difference hash of a grayscale page sample: the image is averaged down to
+    size x (size + 1) cells and each bit records whether a cell is brighter than its
+    left neighbour by more than `step` gray levels (so bits over blank paper do not
+    follow scanner noise). Returns a size*size-bit int; rescans and re-encodes of the
+    same page land a few bits apart.
+    """
+    cells = _area_average(gray, size, size + 1)
+    bits = (cells[:, 1:] > cells[:, :-1] + step).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def duplicate_signature(samples):
+    """
+    Near-duplicate signature of a page sample for is_duplicate: its perceptual_hash and
+    its ink mask inside INK_MARGIN, bit-packed (~60 KB for A4). Empty for pages too
+    small to compare.
+    """
+    gray = _grayscale(samples)
+    dark = _inside_margins(gray) < 160
+    if min(dark.shape) <= 2 * DUPLICATE_MAX_SHIFT + INK_CELL:
+        return {}
+    return {"perceptual_hash": perceptual_hash(gray), "duplicate_sample": (dark.shape, np.packbits(dark))}
+
+
+def is_duplicate(signature, other):
+    """
+    Whether two pages (duplicate_signature dicts, or prepared pages carrying one) are
+    the same page scanned twice. The perceptual hashes must be within
+    DUPLICATE_MAX_DISTANCE bits, which pages on one template (continuation sheets,
+    monthly invoices) also can be; the ink masks then confirm it. They are aligned at
+    the offset (within DUPLICATE_MAX_SHIFT px) where the fewest pixels disagree, and the
+    pages are duplicates only if every ink pixel on either page has ink within one pixel
+    on the other. That absorbs sub-pixel misregistration and stroke blur, but not a
+    different word, date or amount.
+    """
+    if "perceptual_hash" not in signature or "perceptual_hash" not in other:
+        return False
+    if bin(signature["perceptual_hash"] ^ other["perceptual_hash"]).count("1") > DUPLICATE_MAX_DISTANCE:
+        return False
+    (shape, packed), (other_shape, other_packed) = signature["duplicate_sample"], other["duplicate_sample"]
+    if shape != other_shape:
+        return False
+
+    first = np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+    second = np.unpackbits(other_packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+    shift = DUPLICATE_MAX_SHIFT
+    height, width = shape[0] - 2 * shift, shape[1] - 2 * shift
+    first = first[shift:shift + height, shift:shift + width]
+    offsets = [(dy, dx) for dy in range(2 * shift + 1) for dx in range(2 * shift + 1)]
+    dy, dx = min(offsets, key=lambda o: np.count_nonzero(first ^ second[o[0]:o[0] + height, o[1]:o[1] + width]))
+    second = second[dy:dy + height, dx:dx + width]
+
+    return not np.any(first & ~_dilate(second)) and not np.any(second & ~_dilate(first))
+
+
+def find_duplicate(signature, signatures):
+    """Index of the first page in `signatures` (page index -> signature) that is_duplicate matches, or None."""
+    return next((i for i, other in signatures.items() if is_duplicate(signature, other)), None)
+
+
+def text_hash(text):
+    """Fingerprint of a page's text layer, ignoring whitespace differences."""
+    return "text:" + hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def image_hash(image):
+    """Fingerprint of a rendered page: identical pages render to identical JPEG bytes."""
+    return "image:" + hashlib.sha1(image).hexdigest()
+
+
+def render_policy(page, samples=None, ink=None):
+    """
+    Pick zoom and colorspace for a page: the shortest side lands on the size the
+    vision model actually sees (RENDER_TARGET_SHORT_SIDE, or RENDER_SPARSE_SHORT_SIDE
+    for near-empty pages without a text layer), the longest side stays within
+    RENDER_MAX_LONG_SIDE, and monochrome pages are rendered in grayscale.
+    `samples` and `ink` (page_samples, ink_coverage) are reused when already measured.
+    """
+    if samples is None:
+        samples = page_samples(page)
+    if ink is None and not page.get_text("text").strip():
+        ink = ink_coverage(samples)
+    sparse = ink is not None and ink < RENDER_SPARSE_MAX_INK
+    target = RENDER_SPARSE_SHORT_SIDE if sparse else RENDER_TARGET_SHORT_SIDE
+    short_side, long_side = sorted((page.rect.width, page.rect.height))
+    zoom = target / short_side if short_side else RENDER_ZOOM
+    zoom = min(zoom, RENDER_MAX_LONG_SIDE / long_side) if long_side else zoom
+    zoom = max(RENDER_MIN_ZOOM, min(RENDER_MAX_ZOOM, zoom))
+    return zoom, is_monochrome(samples)
+
+
+def _encode_jpeg(pix):
+    """JPEG-encode, stepping quality down until the image fits RENDER_MAX_BYTES."""
+    quality = RENDER_JPEG_QUALITY
+    image = pix.tobytes("jpg", jpg_quality=quality)
+    while len(image) > RENDER_MAX_BYTES and quality - 10 >= RENDER_JPEG_MIN_QUALITY:
+        quality -= 10
+        image = pix.tobytes("jpg", jpg_quality=quality)
+    return image, quality
+
+
+def _rasterize(page, samples=None, ink=None):
+    """
+    Render a page to JPEG under RENDER_POLICY (`samples` / `ink`: see render_policy).
+    Returns: (image bytes, render stats for page_routing)
+    """
+    baseline_size = (page.rect.width * RENDER_ZOOM, page.rect.height * RENDER_ZOOM)
+    if RENDER_POLICY != "adaptive":
+        image = page.get_pixmap(matrix=fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM)).tobytes("jpg")
+        return image, {"image_bytes": len(image), "tiles": vision_tiles(*baseline_size)}
+
+    zoom, grayscale = render_policy(page, samples, ink)
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY if grayscale else fitz.csRGB, alpha=False
+    )
+    image, quality = _encode_jpeg(pix)
+    tiles = vision_tiles(pix.width, pix.height)
+    stats = {
+        "zoom": round(zoom, 3),
+        "grayscale": grayscale,
+        "jpeg_quality": quality,
+        "image_bytes": len(image),
+        "tiles": tiles,
+        "tiles_saved": vision_tiles(*baseline_size) - tiles,
+    }
+    if RENDER_MEASURE_SAVINGS:
+        baseline = page.get_pixmap(matrix=fitz.Matrix(RENDER_ZOOM, RENDER_ZOOM)).tobytes("jpg")
+        stats["bytes_saved"] = len(baseline) - len(image)
+    return image, stats
+
+
+def render_page(doc, page_index):
+    """Rasterize one page to JPEG bytes. Returns None if the page fails to render."""
+    try:
+        return _rasterize(doc.load_page(page_index))[0]
+    except Exception as e:
+        logger.error(f"Failed to process page {page_index+1}: {e}")
+        return None
+
+
+def render_thumbnails(pdf_bytes, page_count, page_indices=None):
+    """
+    Rasterize the first page_count pages (or page_indices) at THUMBNAIL_ZOOM (grayscale)
+    for triage. Cheap enough to run in-process.
+    Returns: list of JPEG bytes, one per page rendered (None for failed pages).
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    thumbnails = []
+    try:
+        for i in (range(page_count) if page_indices is None else page_indices):
+            try:
+                pix = doc.load_page(i).get_pixmap(
+                    matrix=fitz.Matrix(THUMBNAIL_ZOOM, THUMBNAIL_ZOOM), colorspace=fitz.csGRAY
+                )
+                thumbnails.append(pix.tobytes("jpg", jpg_quality=THUMBNAIL_JPEG_QUALITY))
+            except Exception as e:
+                logger.error(f"Failed to render thumbnail for page {i+1}: {e}")
+                thumbnails.append(None)
+        return thumbnails
+    finally:
+        doc.close()
+
+
+def read_text_layer(page):
+    """
+    Read the native text layer of a page as positioned lines.
+
+    Each output line is prefixed with the [x,y] position (PDF points, top-left origin)
+    of its first word so the model can rebuild table columns from the layout.
+    Returns: (text, character count)
+    """
+    lines = {}
+    chars = 0
+    for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words"):
+        lines.setdefault((block_no, line_no), []).append((x0, y0, word))
+        chars += len(word)
+
+    ordered = sorted(lines.values(), key=lambda words: (round(words[0][1]), words[0][0]))
+    text = "\n".join(
+        f"[{words[0][0]:.0f},{words[0][1]:.0f}] " + " ".join(w for _, _, w in words)
+        for words in ordered
+    )
+    return text, chars
+
+
+def image_coverage(page):
+    """Fraction of the page area covered by embedded images (1.0 for a full-page scan)."""
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(covered / page_area, 1.0)
+
+
+def prepare_page(doc, page_index, text_first=False):
+    """
+    Prepare one page for extraction.
+
+    With text_first, pages carrying enough native text (and not dominated by a scanned
+    image) are routed to text extraction and are not rasterized at all. Every other
+    page is rendered to JPEG for the vision model. With PAGE_FILTER, pages with no
+    text layer and (almost) no ink are not rendered either (route "blank"), and every
+    page carries a "fingerprint" (text or image hash) for exact duplicate detection;
+    vision pages also carry their duplicate_signature to catch rescans (is_duplicate).
+
+    Returns: dict with "route" ("text", "vision" or "blank"), "text" or "image", the
+    routing measurements and render_ms; None if the page could not be read.
+    """
+    started = time.perf_counter()
+    try:
+        page = doc.load_page(page_index)
+        stats = {}
+        if text_first:
+            text, chars = read_text_layer(page)
+            coverage = image_coverage(page)
+            stats = {"text_chars": chars, "image_coverage": round(coverage, 3)}
+            if chars >= TEXT_LAYER_MIN_CHARS and coverage <= TEXT_LAYER_MAX_IMAGE_COVERAGE:
+                if PAGE_FILTER:
+                    stats["fingerprint"] = text_hash(text)
+                return {"route": "text", "text": text, **stats,
+                        "render_ms": (time.perf_counter() - started) * 1000}
+
+        samples = ink = None
+        if PAGE_FILTER or RENDER_POLICY == "adaptive":
+            samples = page_samples(page)
+            if not page.get_text("text").strip():
+                ink = ink_coverage(samples)
+                stats["ink"] = round(ink, 5)
+        if PAGE_FILTER and ink is not None and ink < BLANK_PAGE_MAX_INK:
+            return {"route": "blank", **stats, "render_ms": (time.perf_counter() - started) * 1000}
+
+        image, render_stats = _rasterize(page, samples, ink)
+        if PAGE_FILTER:
+            stats["fingerprint"] = image_hash(image)
+            stats.update(duplicate_signature(samples))
+        return {"route": "vision", "image": image, **stats, **render_stats,
+                "render_ms": (time.perf_counter() - started) * 1000}
+    except Exception as e:
+        logger.error(f"Failed to process page {page_index+1}: {e}")
+        return None
+
+
+def _render_page_range(pdf_path, page_indices):
+    """Pool worker: open the PDF from disk and render a run of pages."""
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        logger.error(f"Render worker failed to open PDF: {e}")
+        return [None] * len(page_indices)
+    try:
+        return [render_page(doc, i) for i in page_indices]
+    finally:
+        doc.close()
+
+
+def _prepare_page_range(pdf_path, page_indices, text_first):
+    """Pool worker: like _render_page_range, but returns prepare_page() results."""
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        logger.error(f"Render worker failed to open PDF: {e}")
+        return [None] * len(page_indices)
+    try:
+        return [prepare_page(doc, i, text_first) for i in page_indices]
+    finally:
+        doc.close()
+
+
+def render_single_page(pdf_bytes, page_index):
+    """Render one page in-process (used when a text-routed page must fall back to vision)."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return render_page(doc, page_index)
+    finally:
+        doc.close()
+
+
+def _spill_to_tempfile(pdf_bytes):
+    """Write the PDF to a temp file so pool workers can open it by path."""
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(pdf_bytes)
+        return tmp.name
+
+
+def _split_pages(page_count, chunks):
+    """Split range(page_count) into at most `chunks` contiguous, near-equal ranges."""
+    size, extra = divmod(page_count, chunks)
+    ranges = []
+    start = 0
+    for chunk in range(chunks):
+        end = start + size + (1 if chunk < extra else 0)
+        if end > start:
+            ranges.append(range(start, end))
+        start = end
+    return ranges
+
+
+def render_pdf_pages(pdf_bytes, page_count, page_indices=None):
+    """
+    Render the first page_count pages of a PDF (or page_indices) to JPEG bytes.
+
+    Large documents are split into page ranges across the render pool; each worker
+    opens the PDF itself from a temporary file, so only paths cross the process boundary.
+
+    Returns: list with one entry per page rendered, in order (None for pages that failed).
+    """
+    page_indices = list(range(page_count) if page_indices is None else page_indices)
+    if RENDER_WORKERS <= 1 or len(page_indices) < RENDER_PARALLEL_MIN_PAGES:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            return [render_page(doc, i) for i in page_indices]
+        finally:
+            doc.close()
+
+    pdf_path = _spill_to_tempfile(pdf_bytes)
+    try:
+        pool = get_render_pool()
+        chunks = [
+            page_indices[chunk.start:chunk.stop]
+            for chunk in _split_pages(len(page_indices), min(RENDER_WORKERS, len(page_indices)))
+        ]
+        try:
+            futures = [pool.submit(_render_page_range, pdf_path, chunk) for chunk in chunks]
+        except BrokenProcessPool:
+            futures = [None] * len(chunks)
+        pages = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                if future is None:
+                    raise BrokenProcessPool("render pool was already broken")
+                pages.extend(future.result())
+            except BrokenProcessPool:
+                # A worker died: render this chunk in-process, the next call gets a fresh pool
+                logger.warning(f"Render pool broken, rendering pages {chunk[0]}-{chunk[-1]} in-process")
+                _discard_render_pool(pool)
+                pages.extend(_render_page_range(pdf_path, chunk))
+        return pages
+    finally:
+        os.remove(pdf_path)
+
+
+async def iter_rendered_pages(pdf_bytes, page_count, text_first=False, prefetch=RENDER_PREFETCH,
+                              page_indices=None):
+    """
+    Async generator yielding (page_index, prepared_page) as pages are ready.
+    prepared_page is the prepare_page() dict, or None for pages that failed.
+    page_indices restricts rendering to those pages, yielded in the order given
+    (default: the first page_count, in page order).
+
+    At most `prefetch` pages are prepared ahead of the consumer, so a caller that
+    processes each page before asking for the next holds only a few images at once.
+    """
+    page_indices = list(range(page_count) if page_indices is None else page_indices)
+    if RENDER_WORKERS <= 1 or len(page_indices) < RENDER_PARALLEL_MIN_PAGES:
+        async for item in _iter_pages_in_process(pdf_bytes, page_indices, text_first):
+            yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    pool = get_render_pool()
+    pdf_path = _spill_to_tempfile(pdf_bytes)
+    pending = deque()
+    queued = iter(page_indices)
+    remaining = len(page_indices)
+    try:
+        while remaining or pending:
+            # Keep up to `prefetch` renders queued behind the page being awaited
+            while remaining and len(pending) <= prefetch:
+                next_page = next(queued)
+                try:
+                    future = loop.run_in_executor(pool, _prepare_page_range, pdf_path, [next_page], text_first)
+                except BrokenProcessPool:
+                    _discard_render_pool(pool)
+                    pool = get_render_pool()
+                    future = loop.run_in_executor(pool, _prepare_page_range, pdf_path, [next_page], text_first)
+                pending.append((next_page, future, pool))
+                remaining -= 1
+
+            page_index, future, submitted_to = pending.popleft()
+            try:
+                prepared = (await future)[0]
+            except BrokenProcessPool:
+                # A worker died: prepare this page in-process and queue the rest on a fresh pool
+                logger.warning(f"Render pool broken, preparing page {page_index} in-process")
+                _discard_render_pool(submitted_to)
+                pool = get_render_pool()
+                prepared = (await asyncio.to_thread(_prepare_page_range, pdf_path, [page_index], text_first))[0]
+            yield page_index, prepared
+    finally:
+        for _, future, _ in pending:
+            future.cancel()
+        os.remove(pdf_path)
+
+
+async def _iter_pages_in_process(pdf_bytes, page_indices, text_first):
+    """Streaming fallback without the pool: render sequentially in a thread, one page ahead."""
+    doc = await asyncio.to_thread(fitz.open, stream=pdf_bytes, filetype="pdf")
+    next_task = None
+    try:
+        if page_indices:
+            next_task = asyncio.ensure_future(asyncio.to_thread(prepare_page, doc, page_indices[0], text_first))
+        for position, page_index in enumerate(page_indices):
+            prepared = await next_task
+            next_task = None
+            if position + 1 < len(page_indices):
+                next_task = asyncio.ensure_future(
+                    asyncio.to_thread(prepare_page, doc, page_indices[position + 1], text_first)
+                )
+            yield page_index, prepared
+    finally:
+        # The document must outlive any render still running in the thread pool
+        if next_task is not None:
+            await asyncio.gather(next_task, return_exceptions=True)
+        doc.close()
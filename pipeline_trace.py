@@ -0,0 +1,166 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import observe_stage, record_error
+
+logger = logging.getLogger(__name__)
+
+# The trace for the pipeline running in the current task. asyncio tasks and
+# asyncio.to_thread copy the context, so stages recorded there land in the same trace.
+_current_trace = contextvars.ContextVar("pipeline_trace", default=None)
+
+
+class PipelineTrace:
+    """
+    Wall time per stage and per page, plus token usage of every LLM response,
+    for one pipeline run. Safe to record into from worker threads.
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.stages = {}
+        self.pages = {}
+        self.llm_calls = []
+        self.prompt_projections = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, ms, page=None):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            totals["count"] += 1
+            totals["total_ms"] += ms
+            totals["max_ms"] = max(totals["max_ms"], ms)
+            if page is not None:
+                page_timings = self.pages.setdefault(page, {"page": page})
+                page_timings[f"{stage}_ms"] = round(page_timings.get(f"{stage}_ms", 0.0) + ms, 1)
+
+    def add_llm_call(self, stage, model, ms, response=None, error=None):
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        call = {
+            "stage": stage,
+            "model": model,
+            "ms": round(ms, 1),
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        }
+        if error is not None:
+            call["error"] = type(error).__name__
+        with self._lock:
+            self.llm_calls.append(call)
+
+    def add_prompt_projection(self, stage, payload_tokens, saved_tokens):
+        with self._lock:
+            self.prompt_projections[stage] = {"payload_tokens": payload_tokens, "saved_tokens": saved_tokens}
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def summary(self) -> dict:
+        with self._lock:
+            llm_by_stage = {}
+            for call in self.llm_calls:
+                totals = llm_by_stage.setdefault(call["stage"], {
+                    "calls": 0, "ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0
+                })
+                totals["calls"] += 1
+                totals["ms"] = round(totals["ms"] + call["ms"], 1)
+                for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                    totals[key] += call[key]
+
+            total_ms = self.total_ms if self.total_ms is not None else (time.perf_counter() - self.started) * 1000
+            return {
+                "name": self.name,
+                **self.attrs,
+                "total_ms": round(total_ms, 1),
+                "stages": {
+                    stage: {
+                        "count": t["count"],
+                        "total_ms": round(t["total_ms"], 1),
+                        "max_ms": round(t["max_ms"], 1),
+                    }
+                    for stage, t in self.stages.items()
+                },
+                "pages": [self.pages[p] for p in sorted(self.pages)],
+                "llm": {
+                    "calls": len(self.llm_calls),
+                    "prompt_tokens": sum(c["prompt_tokens"] for c in self.llm_calls),
+                    "completion_tokens": sum(c["completion_tokens"] for c in self.llm_calls),
+                    "cached_tokens": sum(c["cached_tokens"] for c in self.llm_calls),
+                    "errors": sum(1 for c in self.llm_calls if "error" in c),
+                    "prompt_tokens_saved": sum(p["saved_tokens"] for p in self.prompt_projections.values()),
+                    "by_stage": llm_by_stage,
+                    "prompt_projections": dict(self.prompt_projections),
+                },
+            }
+
+
+def current_trace():
+    """The active PipelineTrace, or None when nothing is being traced."""
+    return _current_trace.get()
+
+
+@contextmanager
+def pipeline_trace(name, **attrs):
+    """
+    Trace one pipeline run. Everything recorded in this context (including tasks and
+    threads started from it) is collected, and a structured log line is written on exit.
+    """
+    trace = PipelineTrace(name, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        logger.info(json.dumps({"event": "pipeline_trace", **trace.summary()}, ensure_ascii=False))
+
+
+@contextmanager
+def trace_stage(stage, page=None):
+    """
+    Record the wall time of a block as `stage` (optionally attributed to a page number)
+    in the active trace and the stage latency histogram; exceptions are counted as errors.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_error(stage, e)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        observe_stage(stage, seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(stage, seconds * 1000, page=page)
+
+
+def record_stage(stage, ms, page=None):
+    """Record a duration measured elsewhere (e.g. inside a render worker process)."""
+    observe_stage(stage, ms / 1000)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, ms, page=page)
+
+
+def record_llm_call(stage, model, ms, response=None, error=None):
+    """Record one LLM round trip with the token usage reported in its response."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_llm_call(stage, model, ms, response=response, error=error)
+
+
+def record_prompt_projection(stage, payload_tokens, saved_tokens):
+    """Record the size of a pruned transform prompt payload and the tokens pruning saved."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_prompt_projection(stage, payload_tokens, saved_tokens)
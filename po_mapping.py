@@ -0,0 +1,355 @@
+import datetime
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Label aliases (English / Arabic)
+# -------------------------
+# Labels are compared after _normalize_label, in priority order. A label matches an
+# alias exactly, or through one side of a bilingual label ("Invoice No / رقم الفاتورة");
+# multi-word aliases also match labels that contain them. Exact matches rank first.
+INVOICE_NUMBER_ALIASES = (
+    "invoice no", "invoice number", "invoice #", "tax invoice no", "tax invoice number",
+    "inv no", "bill no", "ref", "ref no", "reference no",
+    "رقم الفاتورة", "رقم الفاتورة الضريبية",
+)
+INVOICE_DATE_ALIASES = (
+    "invoice date", "tax invoice date", "date of invoice", "issue date", "date of issue", "date",
+    "تاريخ الفاتورة", "تاريخ الإصدار", "تاريخ الاصدار", "التاريخ",
+)
+POSTING_DATE_ALIASES = (
+    "posting date", "supply date", "date of supply",
+    "تاريخ التوريد",
+)
+GROSS_AMOUNT_ALIASES = (
+    "total including vat", "total incl vat", "total amount including vat", "total amount incl vat", "total with vat",
+    "total amount with vat", "grand total", "invoice total", "total invoice amount",
+    "total amount due", "total due",
+    "الإجمالي شامل ضريبة القيمة المضافة", "الإجمالي شامل الضريبة", "إجمالي المبلغ المستحق",
+    "المبلغ الإجمالي شامل الضريبة", "الإجمالي مع الضريبة",
+)
+PO_NUMBER_ALIASES = (
+    "po number", "po no", "po #", "po", "purchase order", "purchase order no", "purchase order number",
+    "order number", "order no", "contract po",
+    "رقم أمر الشراء", "أمر الشراء", "رقم امر الشراء", "امر الشراء",
+)
+ITEM_LIST_ALIASES = (
+    "items", "line items", "line_items", "invoice items", "item details", "details",
+    "البنود", "الأصناف", "تفاصيل الفاتورة",
+)
+ITEM_SERIAL_ALIASES = (
+    "no", "s no", "sr", "sr no", "serial", "serial no", "item no", "line", "line no",
+    "م", "الرقم", "رقم البند", "مسلسل",
+)
+ITEM_QUANTITY_ALIASES = (
+    "quantity", "qty", "qty.", "الكمية",
+)
+ITEM_UNIT_ALIASES = (
+    "unit", "uom", "unit of measure", "الوحدة", "وحدة القياس",
+)
+# Item amounts explicitly before VAT
+ITEM_NET_AMOUNT_ALIASES = (
+    "amount before vat", "total before vat", "amount excluding vat", "amount excl vat",
+    "total excluding vat", "total excl vat", "taxable amount", "net amount",
+    "المبلغ غير شامل الضريبة", "المبلغ الخاضع للضريبة", "المبلغ قبل الضريبة",
+)
+# A bare "Amount"/"Total" is only read as the amount before VAT when the row has no VAT column
+ITEM_AMOUNT_ALIASES = (
+    "total amount", "amount", "total", "value", "line total",
+    "المبلغ", "الإجمالي", "القيمة",
+)
+# Invoice-level totals used to check the item amounts
+NET_TOTAL_ALIASES = (
+    "total before vat", "total excluding vat", "total excl vat", "total amount before vat",
+    "total amount excluding vat", "total taxable amount", "taxable amount", "subtotal", "sub total",
+    "الإجمالي غير شامل ضريبة القيمة المضافة", "الإجمالي غير شامل الضريبة", "الإجمالي قبل الضريبة",
+    "المبلغ الخاضع للضريبة",
+)
+VAT_AMOUNT_ALIASES = (
+    "total vat", "vat amount", "total vat amount", "vat total", "total tax", "tax amount",
+    "total tax amount", "value added tax",
+    "إجمالي ضريبة القيمة المضافة", "ضريبة القيمة المضافة", "مبلغ الضريبة", "إجمالي الضريبة",
+)
+# Item amounts must add up to the net total within this much (per item, for rounding)
+AMOUNT_TOLERANCE = 0.01
+
+# Labels a lookup must not accept even when an alias matches (by containment)
+_VAT_INCLUSIVE_LABEL = r"incl|with vat|(?<!غير )شامل"
+_NOT_GROSS_LABEL = r"excl|before|\bnet\b|غير شامل|قبل"
+_NOT_PO_NUMBER_LABEL = r"date|amount|value|total|تاريخ|مبلغ|قيمة|إجمالي"
+# SAP purchase order numbers are all digits
+_PO_NUMBER_PATTERN = re.compile(r"\d{6,12}")
+
+_ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩٫٬", "0123456789.,")
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+_MONTHS = {name: i for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1
+)}
+
+
+def _normalize_label(label) -> str:
+    return re.sub(r"[\s_:.()\-/]+", " ", str(label).lower()).strip()
+
+
+_ALIAS_CACHE = {}
+
+
+def _normalized_aliases(aliases):
+    if aliases not in _ALIAS_CACHE:
+        _ALIAS_CACHE[aliases] = [_normalize_label(a) for a in aliases]
+    return _ALIAS_CACHE[aliases]
+
+
+def _match_rank(label, aliases):
+    """Position of the best alias matching `label` (exact matches rank before contained ones), or None."""
+    normalized = _normalize_label(label)
+    segments = {normalized} | {_normalize_label(part) for part in re.split(r"[/|\n]", str(label))}
+    padded = f" {normalized} "
+    candidates = _normalized_aliases(aliases)
+    for rank, alias in enumerate(candidates):
+        if alias in segments:
+            return rank
+    for rank, alias in enumerate(candidates):
+        if " " in alias and f" {alias} " in padded:
+            return len(candidates) + rank
+    return None
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def find_field(data, aliases, nested=True, exclude=None):
+    """
+    Value of the best-matching scalar field in `data` (and in nested dicts when
+    `nested`), or None. Lists are not searched. Labels matching the `exclude`
+    regex (on the normalized label) are skipped.
+    """
+    best_rank, best_value = None, None
+    pending = [data] if isinstance(data, dict) else []
+    while pending:
+        node = pending.pop(0)
+        for key, value in node.items():
+            if isinstance(value, dict):
+                if nested:
+                    pending.append(value)
+                continue
+            if isinstance(value, list) or _is_empty(value):
+                continue
+            if exclude and re.search(exclude, _normalize_label(key)):
+                continue
+            rank = _match_rank(key, aliases)
+            if rank is not None and (best_rank is None or rank < best_rank):
+                best_rank, best_value = rank, value
+    return best_value
+
+
+def normalize_number(value):
+    """Digits of an extracted amount/quantity without separators ("SAR 46,373.61" -> "46373.61"), or None."""
+    if isinstance(value, bool) or _is_empty(value):
+        return None
+    if isinstance(value, (int, float)):
+        return str(value)
+    match = _NUMBER_PATTERN.search(str(value).translate(_ARABIC_DIGITS).replace(",", ""))
+    return match.group() if match else None
+
+
+def normalize_date(value):
+    """
+    Convert an extracted date to YYYYMMDD, or None when it cannot be read unambiguously.
+
+    Day-first is assumed for numeric dates (as printed on Saudi invoices) unless the
+    month position is > 12. Hijri dates (years before 1900) are rejected.
+    """
+    if _is_empty(value):
+        return None
+    text = str(value).translate(_ARABIC_DIGITS).strip()
+
+    match = re.search(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})", text)
+    if match:
+        year, month, day = (int(g) for g in match.groups())
+    else:
+        match = re.search(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})", text)
+        if match:
+            day, month, year = (int(g) for g in match.groups())
+            if month > 12 and day <= 12:
+                day, month = month, day
+        else:
+            match = (re.search(r"(\d{1,2})[\s-]+([A-Za-z]{3,})[\s,-]+(\d{4})", text)
+                     or re.search(r"([A-Za-z]{3,})\s+(\d{1,2}),?\s+(\d{4})", text))
+            if not match:
+                return None
+            first, second, year = match.groups()
+            day, month_name = (first, second) if first.isdigit() else (second, first)
+            month = _MONTHS.get(month_name[:3].lower())
+            if month is None:
+                return None
+            day, year = int(day), int(year)
+
+    if year < 1900:
+        return None
+    try:
+        return datetime.date(year, month, day).strftime("%Y%m%d")
+    except ValueError:
+        return None
+
+
+def find_item_rows(data) -> list:
+    """All line-item rows (dicts) from every item list in `data`, in document order."""
+    rows = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, list) and _match_rank(key, ITEM_LIST_ALIASES) is not None:
+                rows.extend(row for row in value if isinstance(row, dict))
+            elif isinstance(value, (dict, list)):
+                rows.extend(find_item_rows(value))
+    elif isinstance(data, list):
+        for entry in data:
+            rows.extend(find_item_rows(entry))
+    return rows
+
+
+def _serial_number(value):
+    """A line number (1-999) when the value is nothing but an integer ("3", 3, "٣"), else None."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, float):
+        value = int(value) if value.is_integer() else None
+    text = str(value).translate(_ARABIC_DIGITS).strip()
+    if not re.fullmatch(r"\d{1,3}", text) or int(text) == 0:
+        return None
+    return int(text)
+
+
+def _is_vat_label(label):
+    """Whether a column label mentions VAT / tax (amount, rate or VAT-inclusive total)."""
+    return re.search(r"\b(vat|tax)\b|ضريب", _normalize_label(label)) is not None
+
+
+def _item_amount(row):
+    """
+    Item amount before VAT, or None when the row does not say which column it is.
+    Labels mentioning VAT-inclusive totals are skipped; a generic "Amount"/"Total"
+    is only used when the row has no VAT column (else it may include VAT).
+    """
+    net = normalize_number(find_field(row, ITEM_NET_AMOUNT_ALIASES, nested=False, exclude=_VAT_INCLUSIVE_LABEL))
+    if net is not None:
+        return net
+    if any(_is_vat_label(key) for key in row):
+        return None
+    return normalize_number(find_field(row, ITEM_AMOUNT_ALIASES, nested=False, exclude=_VAT_INCLUSIVE_LABEL))
+
+
+def _invoice_amount(data, aliases, exclude=_VAT_INCLUSIVE_LABEL):
+    """An invoice-level amount; percentages ("VAT 15%") are not amounts."""
+    value = find_field(data, aliases, exclude=exclude)
+    if value is None or "%" in str(value):
+        return None
+    return normalize_number(value)
+
+
+def _amounts_consistent(tax_invoice, gross_amount, items):
+    """
+    Whether the item amounts add up to the invoice's amount before VAT: the net total
+    when printed, else gross minus total VAT. When net total and VAT are both printed,
+    gross must also equal net + VAT. False when the amounts cannot be checked.
+    """
+    net_total = _invoice_amount(tax_invoice, NET_TOTAL_ALIASES)
+    vat = _invoice_amount(tax_invoice, VAT_AMOUNT_ALIASES)
+    if net_total is None:
+        if vat is None:
+            return False
+        net_total = float(gross_amount) - float(vat)
+    elif vat is not None and abs(float(net_total) + float(vat) - float(gross_amount)) > AMOUNT_TOLERANCE * 2:
+        return False
+    total = sum(float(item["itemAmount"]) for item in items)
+    return abs(total - float(net_total)) <= AMOUNT_TOLERANCE * (len(items) + 1)
+
+
+def _map_items(invoice_rows, po_rows, po_number):
+    """
+    Build MIRO item lines from the tax invoice rows. PO rows are zipped in by position
+    (only when both lists have the same length) to fill a missing quantity or unit.
+    """
+    zipped = po_rows if len(po_rows) == len(invoice_rows) else [{}] * len(invoice_rows)
+    items = []
+    for index, (row, po_row) in enumerate(zip(invoice_rows, zipped), 1):
+        # Serial 1 -> poItem 00010; anything that is not a plain line number falls back to the position
+        serial = _serial_number(find_field(row, ITEM_SERIAL_ALIASES, nested=False)) or index
+        quantity = normalize_number(
+            find_field(row, ITEM_QUANTITY_ALIASES, nested=False) or find_field(po_row, ITEM_QUANTITY_ALIASES, nested=False)
+        )
+        unit = find_field(row, ITEM_UNIT_ALIASES, nested=False) or find_field(po_row, ITEM_UNIT_ALIASES, nested=False)
+        items.append({
+            "invoiceDocItem": f"{index:06d}",
+            "poNumber": po_number,
+            "poItem": f"{serial * 10:05d}",
+            "quantity": quantity,
+            "unit": str(unit).strip() if unit else "",
+            "itemAmount": _item_amount(row),
+            "sheetNo": "",
+        })
+    return items
+
+
+def _po_number(purchase_order):
+    """The PO number when one is found and is all digits, else None."""
+    value = find_field(purchase_order, PO_NUMBER_ALIASES, exclude=_NOT_PO_NUMBER_LABEL)
+    if value is None:
+        return None
+    value = re.sub(r"\s+", "", str(value).translate(_ARABIC_DIGITS))
+    return value if _PO_NUMBER_PATTERN.fullmatch(value) else None
+
+
+def map_sap_po(extracted_data: dict):
+    """
+    Rule-based SAP PO (MIRO) mapping of the merged extraction.
+
+    Returns the MIRO payload in the same shape as the LLM transform, or None when a
+    required field (invoice number, document date, gross amount, PO number, or any
+    item's quantity / amount) cannot be resolved, or when the item amounts do not add
+    up to the invoice's amount before VAT (or gross to net + VAT), so the caller can
+    fall back to the LLM.
+    """
+    tax_invoice = extracted_data.get("tax_invoice") or {}
+    purchase_order = extracted_data.get("purchase_order") or {}
+    if not tax_invoice or not purchase_order:
+        return None
+
+    ref_doc_no = find_field(tax_invoice, INVOICE_NUMBER_ALIASES)
+    doc_date = normalize_date(find_field(tax_invoice, INVOICE_DATE_ALIASES))
+    posting_date = normalize_date(find_field(tax_invoice, POSTING_DATE_ALIASES)) or doc_date
+    gross_amount = normalize_number(find_field(tax_invoice, GROSS_AMOUNT_ALIASES, exclude=_NOT_GROSS_LABEL))
+    po_number = _po_number(purchase_order)
+
+    invoice_rows = find_item_rows(tax_invoice)
+    items = _map_items(invoice_rows, find_item_rows(purchase_order), po_number)
+
+    missing = [
+        name for name, value in (
+            ("refDocno", ref_doc_no), ("docDate", doc_date), ("grossAmount", gross_amount),
+            ("poNumber", po_number), ("item", items),
+        ) if not value
+    ]
+    missing += [
+        f"item[{i}].{field}" for i, item in enumerate(items)
+        for field in ("quantity", "itemAmount") if not item[field]
+    ]
+    if missing:
+        logger.info(f"Rule-based PO mapping unresolved: {', '.join(missing)}")
+        return None
+    if not _amounts_consistent(tax_invoice, gross_amount, items):
+        logger.info("Rule-based PO mapping unresolved: item amounts and invoice totals do not agree")
+        return None
+
+    return {
+        "docDate": doc_date,
+        "postingDate": posting_date,
+        "refDocno": str(ref_doc_no).translate(_ARABIC_DIGITS).strip(),
+        "companyCode": "2000",
+        "currency": "SAR",
+        "grossAmount": gross_amount,
+        "item": items,
+    }
@@ -0,0 +1,87 @@
+import json
+import logging
+
+from metrics import record_prompt_tokens_saved
+from pipeline_trace import record_prompt_projection
+
+logger = logging.getLogger(__name__)
+
+# tiktoken is optional: without it token counts are estimated at ~4 characters per token
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def compact_json(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _prune_empty(value):
+    """Drop None / empty-string / empty-container values; they carry nothing for the model."""
+    if isinstance(value, dict):
+        pruned = {k: _prune_empty(v) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if v not in (None, "", {}, [])}
+    if isinstance(value, list):
+        pruned = [_prune_empty(v) for v in value]
+        return [v for v in pruned if v not in (None, "", {}, [])]
+    return value
+
+
+def _header_fields(document):
+    """A document without its item tables (list values), nested header sections kept."""
+    return {
+        k: _header_fields(v) if isinstance(v, dict) else v
+        for k, v in (document or {}).items() if not isinstance(v, list)
+    }
+
+
+def project_for_workflow(extracted_data: dict, workflow: str) -> dict:
+    """
+    The part of the merged extraction a transform prompt actually uses:
+
+    - sap_po: the tax invoice and the purchase order header (PO number, also when
+      nested in a section such as "po_details"); PO item tables, GL documents, IPCs
+      and submittal forms are dropped.
+    - sap_retention: the tax invoice, the supplier code from the submittal form and
+      the contract number from the interim payment certificate.
+    """
+    if workflow == "sap_po":
+        projection = {
+            "tax_invoice": extracted_data.get("tax_invoice", {}),
+            "purchase_order": _header_fields(extracted_data.get("purchase_order")),
+        }
+    elif workflow == "sap_retention":
+        projection = {
+            "tax_invoice": extracted_data.get("tax_invoice", {}),
+            "supplier_code from invoice_submittal_payment_request": extracted_data.get("invoice_submittal_payment_request", {}).get("Supplier Code (SAP)", ""),
+            "contract_number from interim payment certificate": extracted_data.get("interim_payment_certificate", {}).get("Contract Number", ""),
+        }
+    else:
+        raise ValueError(f"Unknown workflow: {workflow}")
+    return _prune_empty(projection)
+
+
+def projected_prompt_data(extracted_data: dict, workflow: str, stage: str) -> str:
+    """
+    Compact JSON of project_for_workflow() for embedding in a transform prompt.
+    Tokens saved against the full extraction pretty-printed (the previous prompt
+    payload) are logged, added to the pipeline trace and counted in metrics.
+    """
+    payload = compact_json(project_for_workflow(extracted_data, workflow))
+    full = json.dumps(
+        {k: v for k, v in extracted_data.items() if k not in ("page_routing", "failed_pages")}, indent=2, ensure_ascii=False
+    )
+    full_tokens, payload_tokens = estimate_tokens(full), estimate_tokens(payload)
+    saved = max(0, full_tokens - payload_tokens)
+    logger.info(f"{stage}: prompt payload {payload_tokens} tokens ({saved} saved of {full_tokens})")
+    record_prompt_projection(stage, payload_tokens, saved)
+    record_prompt_tokens_saved(stage, saved)
+    return payload
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import observe_rate_limit_wait
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Config
+# -------------------------
+# SQLite file holding the token buckets. Every worker process on the host pointing at
+# the same file shares the same budget. Empty disables rate limiting.
+LLM_RATE_LIMIT_DB = os.getenv("LLM_RATE_LIMIT_DB", "/tmp/invoice_llm_rate_limit.sqlite")
+# Per-model limits as "model=requests_per_minute:tokens_per_minute,...".
+# Models not listed are not limited. Set to the account's actual tier limits.
+LLM_RATE_LIMITS = os.getenv(
+    "LLM_RATE_LIMITS",
+    "gpt-4o=5000:450000,gpt-4o-mini=5000:2000000,llama-3.3-70b-versatile=1000:300000",
+)
+# Longest a call queues for budget; after that it is sent anyway (and retried on a 429)
+LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", 30))
+
+# Rough token cost of an image input at detail "high" (a few 512px tiles)
+IMAGE_TOKEN_ESTIMATE = 1000
+DEFAULT_COMPLETION_TOKEN_ESTIMATE = 1000
+
+
+def parse_limits(spec: str) -> dict:
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            model, values = entry.split("=", 1)
+            rpm, tpm = values.split(":", 1)
+            limits[model.strip()] = (float(rpm), float(tpm))
+        except ValueError:
+            logger.error(f"Ignoring malformed LLM_RATE_LIMITS entry: {entry!r}")
+    return limits
+
+
+def estimate_request_tokens(kwargs) -> int:
+    """
+    Token cost of a chat completion request as providers count it against TPM:
+    prompt (~4 characters per token, fixed cost per image) plus max_tokens.
+    """
+    chars, images = 0, 0
+    for message in kwargs.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+    completion = kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKEN_ESTIMATE
+    return chars // 4 + images * IMAGE_TOKEN_ESTIMATE + completion
+
+
+class SharedRateLimiter:
+    """
+    Token buckets for requests and tokens per minute, per model, stored in SQLite so
+    that every gunicorn worker draws from one budget. Each bucket refills continuously
+    at its per-minute limit and holds at most one minute of budget.
+
+    acquire() takes one request and the estimated tokens, waiting (up to
+    LLM_RATE_LIMIT_MAX_WAIT_SECONDS) until both buckets have room. reconcile() corrects
+    the token bucket once the response reports actual usage.
+    """
+
+    def __init__(self, db_path=LLM_RATE_LIMIT_DB, limits=None):
+        self.limits = parse_limits(LLM_RATE_LIMITS) if limits is None else limits
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path and self.limits:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                    " model TEXT NOT NULL, kind TEXT NOT NULL, level REAL NOT NULL, updated REAL NOT NULL,"
+                    " PRIMARY KEY (model, kind))"
+                )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to open rate limit DB {db_path}; LLM calls are not rate limited: {e}")
+                self._db = None
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def _levels(self, model, now):
+        """Current (requests, tokens) bucket levels for `model`, refilled up to `now`."""
+        levels = {}
+        for kind, capacity in zip(("requests", "tokens"), self.limits[model]):
+            row = self._db.execute(
+                "SELECT level, updated FROM rate_buckets WHERE model = ? AND kind = ?", (model, kind)
+            ).fetchone()
+            level, updated = row if row else (capacity, now)
+            levels[kind] = min(capacity, level + (now - updated) * capacity / 60)
+        return levels
+
+    def _store(self, model, now, requests, tokens):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO rate_buckets (model, kind, level, updated) VALUES (?, ?, ?, ?)",
+            [(model, "requests", requests, now), (model, "tokens", tokens, now)],
+        )
+
+    def try_acquire(self, model, tokens) -> float:
+        """Take budget for one request if available and return 0, else return the seconds to wait."""
+        if not self.enabled or model not in self.limits:
+            return 0.0
+        rpm, tpm = self.limits[model]
+        # A request larger than the whole bucket only needs a full bucket
+        tokens = min(tokens, tpm)
+        with self._lock:
+            try:
+                # IMMEDIATE takes the write lock up front, serializing all workers
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    levels = self._levels(model, now)
+                    if levels["requests"] >= 1 and levels["tokens"] >= tokens:
+                        self._store(model, now, levels["requests"] - 1, levels["tokens"] - tokens)
+                        return 0.0
+                    return max(
+                        (1 - levels["requests"]) * 60 / rpm,
+                        (tokens - levels["tokens"]) * 60 / tpm,
+                        0.01,
+                    )
+                finally:
+                    self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.error(f"Rate limiter failed, not limiting this call: {e}")
+                return 0.0
+
+    def reconcile(self, model, estimated, actual):
+        """Return over-estimated tokens to the bucket (or take the shortfall)."""
+        if not self.enabled or model not in self.limits or not actual:
+            return
+        tpm = self.limits[model][1]
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    levels = self._levels(model, now)
+                    tokens = min(tpm, levels["tokens"] + min(estimated, tpm) - actual)
+                    self._store(model, now, levels["requests"], tokens)
+                finally:
+                    self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.error(f"Rate limiter reconcile failed: {e}")
+
+    def acquire(self, model, tokens):
+        """Block until the model has budget for the request (or the max wait has passed)."""
+        if not self.enabled or model not in self.limits:
+            return
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire(model, tokens)
+            waited = time.monotonic() - started
+            if wait == 0:
+                break
+            if waited >= LLM_RATE_LIMIT_MAX_WAIT_SECONDS:
+                logger.warning(f"Rate limit budget for {model} still exhausted after {waited:.1f}s; sending anyway")
+                break
+            time.sleep(min(wait, 1.0, LLM_RATE_LIMIT_MAX_WAIT_SECONDS - waited))
+        observe_rate_limit_wait(model, time.monotonic() - started)
+
+    async def acquire_async(self, model, tokens):
+        """Async acquire(): the SQLite step runs in a thread, waiting happens on the event loop."""
+        if not self.enabled or model not in self.limits:
+            return
+        started = time.monotonic()
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, model, tokens)
+            waited = time.monotonic() - started
+            if wait == 0:
+                break
+            if waited >= LLM_RATE_LIMIT_MAX_WAIT_SECONDS:
+                logger.warning(f"Rate limit budget for {model} still exhausted after {waited:.1f}s; sending anyway")
+                break
+            await asyncio.sleep(min(wait, 1.0, LLM_RATE_LIMIT_MAX_WAIT_SECONDS - waited))
+        observe_rate_limit_wait(model, time.monotonic() - started)
+
+
+# Process-wide limiter used by the LLM call wrappers in Invoice_extractor
+rate_limiter = SharedRateLimiter()
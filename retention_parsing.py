@@ -0,0 +1,160 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Labels (English / Arabic)
+# -------------------------
+# Advance payment / advance recovery rows in the tax invoice payment summary. English
+# terms match whole words ("Advanced Construction Co." is not an advance); Arabic
+# phrases match as substrings.
+RETENTION_ADVANCE_TERMS = (
+    "advance",
+    "advances",
+    "دفعات مقدمة",
+    "دفعة مقدمة",
+    "الدفعة المقدمة",
+    "استرداد الدفعة",
+)
+# Fields that hold a row's label in a payment summary table
+DESCRIPTION_KEY_PATTERN = re.compile(
+    r"desc|particular|detail|label|narration|item|البيان|الوصف|التفاصيل|البند"
+)
+# Columns of a payment summary row that can hold an amount
+AMOUNT_KEY_PATTERN = re.compile(
+    r"amount|total|value|net|sar|sum|المبلغ|القيمة|الإجمالي|الاجمالي|الصافي|ريال"
+)
+# Period columns of a payment summary: only the current period is this invoice's amount
+CURRENT_PERIOD_KEY_PATTERN = re.compile(r"this invoice|this period|current|الحالي|هذه الفاتورة")
+OTHER_PERIOD_KEY_PATTERN = re.compile(r"previous|prior|cumulative|to date|السابق|التراكمي|حتى تاريخه")
+# Labels of rates, dates and row numbers, which never hold an advance amount
+NON_AMOUNT_KEY_PATTERN = re.compile(r"percent|%|rate|date|\bno\b|\bsr\b|serial|نسبة|تاريخ|رقم")
+
+_ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩٫٬", "0123456789.,")
+_AMOUNT_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+_DATE_PATTERN = re.compile(r"\d{1,4}\s*[-/.]\s*\d{1,2}\s*[-/.]\s*\d{1,4}")
+_ADVANCE_PATTERN = re.compile(
+    "|".join(
+        rf"\b{re.escape(term)}\b" if term.isascii() else re.escape(term)
+        for term in RETENTION_ADVANCE_TERMS
+    )
+)
+
+
+def _normalize_label(label) -> str:
+    return re.sub(r"[\s_:.()\-/]+", " ", str(label).lower()).strip()
+
+
+def _mentions_advance(text) -> bool:
+    return _ADVANCE_PATTERN.search(_normalize_label(text)) is not None
+
+
+def _parse_amount(value):
+    """
+    Number in an extracted amount ("(79,245.00) SAR" -> 79245.0), or None.
+    Percentages and dates are not amounts.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str) or "%" in value:
+        return None
+    text = value.translate(_ARABIC_DIGITS)
+    if _DATE_PATTERN.search(text):
+        return None
+    match = _AMOUNT_PATTERN.search(text.replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def _row_amount(row):
+    """
+    This invoice's amount in a payment summary row: the current-period column when
+    the row has one, else its plain amount column(s). Returns None when there is no
+    such column, or when the candidate columns disagree.
+    """
+    current, plain = [], []
+    for key, value in row.items():
+        label = _normalize_label(key)
+        if NON_AMOUNT_KEY_PATTERN.search(label) or OTHER_PERIOD_KEY_PATTERN.search(label):
+            continue
+        amount = _parse_amount(value)
+        if amount is None:
+            continue
+        if CURRENT_PERIOD_KEY_PATTERN.search(label):
+            current.append(amount)
+        elif AMOUNT_KEY_PATTERN.search(label):
+            plain.append(amount)
+    candidates = current or plain
+    if not candidates or len(set(candidates)) > 1:
+        return None
+    return candidates[0]
+
+
+def _collect_advance_amounts(node, amounts, mentions):
+    """
+    Walk extracted invoice data and collect the amounts of advance rows, either
+    {"Recovery of Advance Payment": "79,245.00"} or a table row whose description
+    field mentions an advance (only the current-period amount is read, see _row_amount).
+
+    `mentions` collects advance references that do not yield an amount: advance
+    labels with a rate, date, previous/cumulative period or unreadable value, rows
+    without a single current amount, and advance wording in any other field. They
+    make the case undecidable.
+    """
+    if isinstance(node, list):
+        for entry in node:
+            _collect_advance_amounts(entry, amounts, mentions)
+        return
+    if not isinstance(node, dict):
+        return
+
+    advance_row = False
+    for key, value in node.items():
+        if isinstance(value, (dict, list)):
+            _collect_advance_amounts(value, amounts, mentions)
+        elif _mentions_advance(key):
+            label = _normalize_label(key)
+            skip = NON_AMOUNT_KEY_PATTERN.search(label) or OTHER_PERIOD_KEY_PATTERN.search(label)
+            amount = None if skip else _parse_amount(value)
+            if amount is None:
+                mentions.append(key)
+            else:
+                amounts.append(amount)
+        elif isinstance(value, str) and _mentions_advance(value):
+            if DESCRIPTION_KEY_PATTERN.search(_normalize_label(key)):
+                advance_row = True
+            else:
+                mentions.append(value)
+
+    if advance_row:
+        amount = _row_amount(node)
+        if amount is None:
+            mentions.append(node)
+        else:
+            amounts.append(amount)
+
+
+def parse_retention_case(tax_invoice: dict):
+    """
+    Deterministic retention case detection from the extracted tax invoice.
+
+    Returns "advance_retention" when an advance / recovery of advance row carries a
+    non-zero amount, "simple_retention" when there is no advance reference at all or
+    every advance amount read is zero, and None when it cannot tell (no tax invoice
+    data, or advance references that are not clearly a payment summary amount), so
+    the caller lets the model decide.
+    """
+    if not tax_invoice:
+        return None
+
+    amounts, mentions = [], []
+    _collect_advance_amounts(tax_invoice, amounts, mentions)
+
+    if any(abs(amount) > 0 for amount in amounts):
+        return "advance_retention"
+    if mentions:
+        logger.info(f"Retention case undecided: {len(mentions)} advance references without an amount")
+        return None
+    return "simple_retention"
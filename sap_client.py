@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class CsrfTokenError(Exception):
+    """SAP did not return an x-csrf-token on the fetch request."""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"No x-csrf-token in SAP response (HTTP {response.status_code})")
+        self.response = response
+
+
+class SapCsrfSession:
+    """
+    App-lifetime connection to one SAP endpoint with CSRF token reuse.
+
+    SAP ties the x-csrf-token to the session cookies set on the fetch request. The
+    pooled httpx client keeps those cookies and its TCP/TLS connections alive, so the
+    token is fetched once and reused by every post until SAP rejects it with
+    403 "CSRF token validation failed"; only then is it fetched again.
+    """
+
+    def __init__(self, token_url, auth, fetch_headers=None, timeout=5.0):
+        self.token_url = token_url
+        self.auth = auth
+        self.fetch_headers = fetch_headers or {}
+        self.timeout = timeout
+        self._client = None
+        self._token = None
+        self._lock = asyncio.Lock()
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            # SAP APIs use self-signed certificates
+            self._client = httpx.AsyncClient(auth=self.auth, verify=False, timeout=self.timeout)
+        return self._client
+
+    async def get_token(self, stale_token=None):
+        """
+        Return the cached CSRF token, fetching one if there is none.
+        Pass the token SAP just rejected as stale_token to force a refetch; concurrent
+        callers that saw the same rejection share a single refetch.
+        """
+        async with self._lock:
+            if self._token and self._token != stale_token:
+                return self._token
+
+            fetch_res = await self._get_client().get(
+                self.token_url,
+                headers={"x-csrf-token": "fetch", **self.fetch_headers}
+            )
+            token = fetch_res.headers.get("x-csrf-token")
+            if not token or token.lower() == "required":
+                self._token = None
+                raise CsrfTokenError(fetch_res)
+
+            self._token = token
+            return token
+
+    @staticmethod
+    def _is_csrf_rejection(response: httpx.Response) -> bool:
+        return response.status_code == 403 and (
+            response.headers.get("x-csrf-token", "").lower() == "required"
+            or "csrf token validation failed" in response.text.lower()
+        )
+
+    async def post(self, url, payload, headers=None):
+        """POST a JSON payload with the session's CSRF token, refetching it once if SAP rejects it."""
+        client = self._get_client()
+        token = await self.get_token()
+        response = await client.post(url, headers={"x-csrf-token": token, **(headers or {})}, json=payload)
+
+        if self._is_csrf_rejection(response):
+            logger.info(f"SAP rejected CSRF token for {url}, refetching")
+            token = await self.get_token(stale_token=token)
+            response = await client.post(url, headers={"x-csrf-token": token, **(headers or {})}, json=payload)
+
+        return response
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._token = None
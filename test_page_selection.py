@@ -0,0 +1,102 @@
+"""
+Unit tests for page ranking, triage selection and the early-exit check in page_selection.py.
+Run with: python -m pytest test_page_selection.py
+"""
+
+from page_selection import (
+    page_keyword_hits, predicted_document_type, rank_pages, required_documents_extracted,
+    select_pages_for_workflow,
+)
+
+FILLER = "Project site photographs and drawings, sheet reference attached."
+
+
+def test_page_without_text_layer_has_no_hits():
+    assert page_keyword_hits("  ") is None
+    assert predicted_document_type(None) is None
+
+
+def test_keywords_match_whole_words():
+    hits = page_keyword_hits("English language drawing notes for the general layout")
+    assert hits["gl_document"] == 0
+    assert predicted_document_type(hits) == "other"
+
+
+def test_keyword_hits_predict_document_type():
+    hits = page_keyword_hits("PURCHASE ORDER  PO Number 3020007108  Purchase order date 05/01/2025")
+    assert predicted_document_type(hits) == "purchase_order"
+
+
+def test_rank_pages_puts_best_page_per_type_first():
+    page_hits = [
+        page_keyword_hits(FILLER),
+        None,
+        page_keyword_hits("Tax Invoice فاتورة ضريبية VAT number, VAT total"),
+        page_keyword_hits(FILLER),
+        page_keyword_hits("Purchase Order - PO Number 3020007108"),
+        page_keyword_hits("Payment summary, total including VAT"),
+    ]
+    ranked = rank_pages(page_hits)
+    assert ranked[:2] == [2, 4]
+    assert ranked[2] == 5
+    assert ranked[3] == 1
+    assert sorted(ranked) == list(range(len(page_hits)))
+
+
+def test_rank_pages_without_text_keeps_page_order():
+    assert rank_pages([None, None, None]) == [0, 1, 2]
+
+
+def test_select_pages_for_po_workflow():
+    page_types = ["tax_invoice", "tax_invoice", "other", "purchase_order", "gl_document", None]
+    assert select_pages_for_workflow(page_types) == [0, 1, 3, 5]
+
+
+def test_select_pages_for_retention_workflow():
+    page_types = ["tax_invoice", "interim_payment_certificate", "gl_document", "invoice_submittal_payment_request"]
+    assert select_pages_for_workflow(page_types) == [0, 1, 3]
+
+
+def test_select_pages_without_tax_invoice_selects_everything():
+    assert select_pages_for_workflow(["other", "gl_document"]) == [0, 1]
+
+
+def test_select_pages_honours_workflow_override():
+    page_types = ["tax_invoice", "purchase_order", "interim_payment_certificate"]
+    assert select_pages_for_workflow(page_types, "sap_retention") == [0, 2]
+
+
+def test_po_workflow_complete():
+    finished = {0: "tax_invoice", 1: "other", 2: "purchase_order", 3: "other"}
+    assert required_documents_extracted(finished, {4: "other", 5: "gl_document"})
+
+
+def test_po_workflow_waits_for_unknown_pages():
+    finished = {0: "tax_invoice", 1: "other", 2: "purchase_order", 3: "other"}
+    assert not required_documents_extracted(finished, {4: None})
+
+
+def test_waits_for_neighbour_of_extracted_document():
+    finished = {0: "tax_invoice", 2: "purchase_order", 3: "other"}
+    assert not required_documents_extracted(finished, {1: "other"})
+
+
+def test_waits_for_predicted_needed_page():
+    finished = {0: "tax_invoice", 1: "other", 2: "purchase_order", 3: "other"}
+    assert not required_documents_extracted(finished, {4: "tax_invoice"})
+
+
+def test_retention_waits_for_possible_purchase_order():
+    finished = {0: "tax_invoice", 1: "other"}
+    assert not required_documents_extracted(finished, {2: "purchase_order"})
+    assert not required_documents_extracted(finished, {2: None})
+    assert required_documents_extracted(finished, {2: "other", 3: "gl_document"})
+
+
+def test_retention_override_waits_for_submittal_form():
+    finished = {0: "tax_invoice", 1: "other"}
+    assert not required_documents_extracted(finished, {2: "invoice_submittal_payment_request"}, "sap_retention")
+
+
+def test_missing_tax_invoice_is_not_complete():
+    assert not required_documents_extracted({0: "purchase_order", 1: "other"}, {2: "other"})
@@ -0,0 +1,144 @@
+"""
+Unit tests for the rule-based SAP PO (MIRO) mapping in po_mapping.py.
+Run with: python -m pytest test_po_mapping.py
+"""
+
+from po_mapping import _item_amount, _map_items, _serial_number, map_sap_po
+
+
+def _invoice(items, **totals):
+    return {
+        "tax_invoice": {
+            "Invoice No": "INV-1001",
+            "Invoice Date": "15/01/2025",
+            "Total Including VAT": "230.00",
+            **totals,
+            "items": items,
+        },
+        "purchase_order": {"PO Number": "4500000001"},
+    }
+
+
+def test_serial_number_accepts_plain_integers():
+    assert _serial_number("3") == 3
+    assert _serial_number(12) == 12
+    assert _serial_number(2.0) == 2
+    assert _serial_number("٣") == 3
+
+
+def test_serial_number_rejects_text_with_numbers():
+    assert _serial_number("Cement 50kg bags") is None
+    assert _serial_number("1.5") is None
+    assert _serial_number("0") is None
+    assert _serial_number("1000") is None
+
+
+def test_item_description_is_not_read_as_serial():
+    rows = [{"Item": "Cement 50kg bags", "Qty": "10", "Unit": "BAG", "Amount": "500"}]
+    items = _map_items(rows, [], "4500000001")
+    assert items[0]["poItem"] == "00010"
+
+
+def test_serial_column_sets_po_item():
+    rows = [
+        {"S No": "2", "Qty": "1", "Amount": "100"},
+        {"S No": "5", "Qty": "1", "Amount": "200"},
+    ]
+    items = _map_items(rows, [], "4500000001")
+    assert [item["poItem"] for item in items] == ["00020", "00050"]
+
+
+def test_item_amount_prefers_explicit_net_column():
+    row = {"Qty": 2, "Amount Before VAT": "100", "VAT": "15", "Total": "115"}
+    assert _item_amount(row) == "100"
+
+
+def test_bare_total_is_not_read_as_net_when_row_has_vat():
+    row = {"Qty": 2, "Unit Price": "50", "VAT": "15", "Total": "115"}
+    assert _item_amount(row) is None
+
+
+def test_bare_arabic_total_is_not_read_as_net_when_row_has_vat():
+    row = {"الكمية": 2, "ضريبة القيمة المضافة": "15", "الإجمالي": "115"}
+    assert _item_amount(row) is None
+
+
+def test_bare_amount_is_used_without_vat_column():
+    row = {"Qty": 2, "Unit Price": "50", "Amount": "100"}
+    assert _item_amount(row) == "100"
+
+
+def test_vat_inclusive_row_falls_back_to_llm():
+    data = _invoice(
+        [{"Qty": 2, "Unit Price": "50", "VAT": "15", "Total": "115"},
+         {"Qty": 1, "Unit Price": "100", "VAT": "15", "Total": "115"}],
+        **{"Total VAT": "30.00"},
+    )
+    assert map_sap_po(data) is None
+
+
+def test_amounts_matching_gross_minus_vat_are_mapped():
+    data = _invoice(
+        [{"Qty": 2, "Unit": "EA", "Amount": "100"}, {"Qty": 1, "Unit": "EA", "Amount": "100"}],
+        **{"Total VAT": "30.00"},
+    )
+    payload = map_sap_po(data)
+    assert payload is not None
+    assert payload["grossAmount"] == "230.00"
+    assert [item["itemAmount"] for item in payload["item"]] == ["100", "100"]
+    assert payload["docDate"] == "20250115"
+
+
+def test_amounts_matching_net_total_are_mapped():
+    data = _invoice(
+        [{"Qty": 2, "Amount": "120"}, {"Qty": 1, "Amount": "80"}],
+        **{"Total Before VAT": "200.00"},
+    )
+    assert map_sap_po(data) is not None
+
+
+def test_amounts_not_adding_up_fall_back_to_llm():
+    data = _invoice(
+        [{"Qty": 2, "Amount": "115"}, {"Qty": 1, "Amount": "115"}],
+        **{"Total VAT": "30.00"},
+    )
+    assert map_sap_po(data) is None
+
+
+def test_unverifiable_amounts_fall_back_to_llm():
+    data = _invoice([{"Qty": 2, "Amount": "100"}, {"Qty": 1, "Amount": "100"}], **{"VAT Rate": "15%"})
+    assert map_sap_po(data) is None
+
+
+def test_net_grand_total_is_not_read_as_gross():
+    data = _invoice([{"Qty": 1, "Amount": "1000"}])
+    del data["tax_invoice"]["Total Including VAT"]
+    data["tax_invoice"].update({
+        "Grand Total (Excl. VAT)": "1,000.00", "VAT Amount": "150.00", "Total Amount (Incl. VAT)": "1,150.00",
+    })
+    payload = map_sap_po(data)
+    assert payload is not None
+    assert payload["grossAmount"] == "1150.00"
+
+
+def test_gross_not_matching_net_plus_vat_falls_back_to_llm():
+    data = _invoice(
+        [{"Qty": 1, "Amount": "200"}],
+        **{"Total Before VAT": "200.00", "VAT Amount": "30.00"},
+    )
+    data["tax_invoice"]["Total Including VAT"] = "200.00"
+    assert map_sap_po(data) is None
+
+
+def test_purchase_order_date_is_not_read_as_po_number():
+    data = _invoice([{"Qty": 2, "Amount": "100"}, {"Qty": 1, "Amount": "100"}], **{"Total VAT": "30.00"})
+    data["purchase_order"] = {"PO #": "3020007108", "Purchase Order Date": "05/01/2025"}
+    payload = map_sap_po(data)
+    assert payload is not None
+    assert payload["item"][0]["poNumber"] == "3020007108"
+
+
+def test_po_number_that_is_not_digits_falls_back_to_llm():
+    data = _invoice([{"Qty": 2, "Amount": "100"}, {"Qty": 1, "Amount": "100"}], **{"Total VAT": "30.00"})
+    data["purchase_order"] = {"Purchase Order": "see attached"}
+    assert map_sap_po(data) is None
@@ -0,0 +1,96 @@
+"""
+Unit tests for the deterministic retention case detection in retention_parsing.py.
+Run with: python -m pytest test_retention_parsing.py
+"""
+
+from retention_parsing import parse_retention_case
+
+
+def test_recovery_of_advance_amount_is_advance_retention():
+    invoice = {"payment_summary": {"Retention 10%": "8,800.00", "Recovery of Advance Payment": "(79,245.00)"}}
+    assert parse_retention_case(invoice) == "advance_retention"
+
+
+def test_advance_table_row_is_advance_retention():
+    invoice = {"payment_summary": [
+        {"description": "Gross Value of Work Done", "amount": "880,000.00"},
+        {"description": "Less: Recovery of Advance Payment", "amount": "79,245.00"},
+    ]}
+    assert parse_retention_case(invoice) == "advance_retention"
+
+
+def test_arabic_advance_row_is_advance_retention():
+    invoice = {"ملخص الدفع": [{"البيان": "استرداد الدفعة المقدمة", "المبلغ": "٧٩٬٢٤٥٫٠٠"}]}
+    assert parse_retention_case(invoice) == "advance_retention"
+
+
+def test_no_advance_is_simple_retention():
+    invoice = {"Invoice No": "INV-7", "payment_summary": {"Retention 10%": "8,800.00", "Net Payable": "79,200.00"}}
+    assert parse_retention_case(invoice) == "simple_retention"
+
+
+def test_zero_advance_amount_is_simple_retention():
+    invoice = {"payment_summary": {"Recovery of Advance Payment": "0.00"}}
+    assert parse_retention_case(invoice) == "simple_retention"
+
+
+def test_seller_named_advanced_is_simple_retention():
+    invoice = {
+        "seller": {"name": "Advanced Construction Co.", "vat_number": "300012345600003"},
+        "payment_summary": {"Retention 10%": "8,800.00"},
+    }
+    assert parse_retention_case(invoice) == "simple_retention"
+
+
+def test_supplier_name_advanced_is_simple_retention():
+    invoice = {"supplier_name": "Advanced Trading Est", "Total": "10,000.00"}
+    assert parse_retention_case(invoice) == "simple_retention"
+
+
+def test_date_in_advance_row_is_not_an_amount():
+    invoice = {"payment_summary": [{"description": "Advance Payment", "date": "23/12/2024", "amount": "0.00"}]}
+    assert parse_retention_case(invoice) == "simple_retention"
+
+
+def test_advance_percentage_is_undecided():
+    assert parse_retention_case({"advance_payment_percentage": 10}) is None
+
+
+def test_advance_in_other_field_is_undecided():
+    invoice = {"notes": "Advance payment to be recovered from future invoices"}
+    assert parse_retention_case(invoice) is None
+
+
+def test_advance_row_without_amount_column_is_undecided():
+    invoice = {"payment_summary": [{"description": "Recovery of Advance Payment", "remarks": "see IPC"}]}
+    assert parse_retention_case(invoice) is None
+
+
+def test_empty_invoice_is_undecided():
+    assert parse_retention_case({}) is None
+
+
+def test_only_current_period_of_advance_row_is_read():
+    invoice = {"payment_summary": [{
+        "Particulars": "Advance payment recovery",
+        "This Invoice": "0.00", "Previous": "79,245.00", "Cumulative": "79,245.00",
+    }]}
+    assert parse_retention_case(invoice) == "simple_retention"
+
+
+def test_current_period_advance_recovery_is_advance_retention():
+    invoice = {"payment_summary": [{
+        "Particulars": "Advance payment recovery",
+        "This Invoice": "12,500.00", "Previous": "66,745.00", "Cumulative": "79,245.00",
+    }]}
+    assert parse_retention_case(invoice) == "advance_retention"
+
+
+def test_advance_row_with_only_cumulative_column_is_undecided():
+    invoice = {"payment_summary": [{"Particulars": "Advance payment recovery", "Cumulative": "79,245.00"}]}
+    assert parse_retention_case(invoice) is None
+
+
+def test_advance_row_with_disagreeing_amount_columns_is_undecided():
+    invoice = {"payment_summary": [{"description": "Advance recovery", "Amount": "0.00", "Total": "79,245.00"}]}
+    assert parse_retention_case(invoice) is None